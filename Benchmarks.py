@@ -0,0 +1,334 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+"""
+Times the parts of the Map and RegionMap which most of a run is spent in.
+Each benchmark is run across a grid of map sizes and step counts and records
+the wall time, the number of cell updates per second and the peak memory
+allocated. The results are saved as JSON so that a later run can be compared
+against them to catch regressions.
+
+Run with, for example:
+    python Benchmarks.py --sizes 15 50 200 --steps 10 50 --output new.json
+    python Benchmarks.py --baseline new.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import MapKernels
+from MapFunctions import RegionMap
+from MapStructures import Map
+
+
+class BenchmarkSuite:
+    """
+    This class runs each benchmark over every combination of map size and
+    number of steps. A benchmark is made of a setup function, which is not
+    timed, and a run function, which is.
+    """
+
+    # The smallest map which can be benchmarked. The Map's forcing functions
+    # and the disturbance placed by new_map reach 17 points into the
+    # buffered arrays, which have 6 more points than the map.
+    smallest_size = 12
+
+    def __init__(self, sizes=(15, 50, 200), steps=(10, 50), repeats=3,
+                 backends=None):
+        """
+        :param sizes: The numbers of points across the maps to benchmark.
+        :param steps: The numbers of time steps to run each benchmark for.
+        :param repeats: The number of times each benchmark is timed. The
+                        fastest time is kept.
+        :param backends: The Map backends to benchmark. Defaults to numpy and
+                         sparse, and numba as well if it is installed.
+        """
+
+        if min(sizes) < self.smallest_size:
+            raise ValueError('every size must be at least {}'
+                             .format(self.smallest_size))
+        if backends is None:
+            backends = ['numpy', 'sparse'] + (['numba'] if MapKernels.HAVE_NUMBA
+                                              else [])
+
+        self.sizes = list(sizes)
+        self.steps = list(steps)
+        self.repeats = repeats
+        self.backends = list(backends)
+
+    def measure(self, name, size, steps, setup, run, cells):
+        """
+        Times one benchmark and finds its peak memory.
+
+        :param name: The name of the benchmark.
+        :param size: The number of points across the map.
+        :param steps: The number of time steps run.
+        :param setup: A function which prepares and returns the state the
+                      benchmark runs on.
+        :param run: A function which is given the state and does the work
+                    being timed.
+        :param cells: The number of cells updated by one call of run.
+        :return: A dictionary of the results.
+        """
+
+        # The first run is not timed, so that compiling the numba kernels and
+        # filling caches is left out.
+        run(setup())
+
+        times = []
+        for repeat in range(self.repeats):
+            state = setup()
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+
+        # Memory is traced in a separate run, since tracing slows the run
+        # down too much to be timed at the same time.
+        state = setup()
+        tracemalloc.start()
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        wall_time = min(times)
+        return {'name': name, 'size': size, 'steps': steps,
+                'wall_time': wall_time,
+                'cell_updates_per_second': cells / wall_time if wall_time
+                else float('inf'),
+                'peak_memory': peak}
+
+    def new_map(self, size):
+        """
+        Creates a map of the same set up as weatherScript.py.
+
+        :param size: The number of points across the region of interest.
+        :return: The map, ready to calculate its first time step.
+        """
+
+        aramour = Map(seed=0)
+        aramour.prepare_map_arrays(size, history='rolling')
+        aramour.initialise_values(100, 0.04)
+        aramour.create_next_time_step()
+        aramour.Light[0, 11, 11] = 150
+        aramour.LDPressure[0, 11, 11] = 250
+
+        return aramour
+
+    def map_benchmarks(self, size, steps):
+        """
+        Finds the benchmarks of the Map.
+
+        :param size: The number of points across the region of interest.
+        :param steps: The number of time steps to run for.
+        :return: A list of (name, setup, run, cells) for each benchmark.
+        """
+
+        cells = steps * (size + 4) ** 2
+        edge_cells = steps * 4 * (size + 4)
+        setup = lambda: self.new_map(size)
+
+        def advance(run_step):
+            def run(aramour):
+                for tstep in range(1, steps + 1):
+                    run_step(aramour, tstep)
+                    aramour.create_next_time_step()
+            return run
+
+        benchmarks = []
+        for backend in self.backends:
+            benchmarks.append((
+                'calculate_next_time_step[{}]'.format(backend), setup,
+                advance(lambda aramour, tstep, backend=backend:
+                        aramour.calculate_next_time_step(
+                            aramour.Light, aramour.DifLight,
+                            aramour.LDPressure, tstep, size,
+                            backend=backend)), cells))
+            benchmarks.append((
+                'step[{}]'.format(backend), setup,
+                advance(lambda aramour, tstep, backend=backend:
+                        aramour.step(tstep, size, backend=backend)),
+                2 * cells))
+
+        benchmarks.append((
+            'update_pressure', setup,
+            advance(lambda aramour, tstep: aramour.update_pressure(
+                aramour.Light, aramour.Dark, aramour.LDPressure, tstep,
+                size)), cells))
+        benchmarks.append((
+            'generate_BCs', setup,
+            advance(lambda aramour, tstep: aramour.generate_BCs(
+                aramour.Light, tstep, size)), edge_cells))
+        benchmarks.append((
+            'create_next_time_step', setup,
+            advance(lambda aramour, tstep: None), 3 * steps * (size + 6) ** 2))
+
+        return benchmarks
+
+    def region_benchmarks(self, size, steps, folder):
+        """
+        Finds the benchmarks of the RegionMap.
+
+        :param size: The number of points from north to south and east to
+                     west.
+        :param steps: The number of time steps to run for.
+        :param folder: The folder to save maps into.
+        :return: A list of (name, setup, run, cells) for each benchmark.
+        """
+
+        centre = np.array([size // 2, size // 5])
+        cells = steps * 12 * size * size
+        filename = os.path.join(folder, 'benchmark_{}_{}'.format(size, steps))
+
+        def new_region():
+            region = RegionMap(seed=0)
+            region.initialise_map(size, size)
+            return region
+
+        def run_region():
+            region = new_region()
+            with contextlib.redirect_stdout(io.StringIO()):
+                region.find_magic(0, steps, size, size, centre)
+            return region
+
+        def find_magic(region):
+            with contextlib.redirect_stdout(io.StringIO()):
+                region.find_magic(0, steps, size, size, centre)
+
+        def save(region):
+            region.save_map(filename, centre)
+
+        def load(region):
+            region.load_map(filename)
+
+        def saved_region():
+            region = run_region()
+            region.save_map(filename, centre)
+            return RegionMap()
+
+        return [('find_magic', new_region, find_magic, cells),
+                ('save_map', run_region, save, cells),
+                ('load_map', saved_region, load, cells)]
+
+    def run(self, progress=print):
+        """
+        Runs every benchmark.
+
+        :param progress: A function which is given a line of text as each
+                         benchmark finishes, or None for no output.
+        :return: A list of the results of each benchmark.
+        """
+
+        results = []
+        with tempfile.TemporaryDirectory() as folder:
+            for size in self.sizes:
+                for steps in self.steps:
+                    for name, setup, run, cells in (
+                            self.map_benchmarks(size, steps) +
+                            self.region_benchmarks(size, steps, folder)):
+                        result = self.measure(name, size, steps, setup, run,
+                                              cells)
+                        results.append(result)
+                        if progress is not None:
+                            progress('{name:>32} size {size:>5} steps '
+                                     '{steps:>4}: {wall_time:9.4f} s '
+                                     '{cell_updates_per_second:12.3e} cells/s '
+                                     '{peak_memory:>12} B'.format(**result))
+
+        return results
+
+    def save(self, results, filename):
+        """
+        Saves the results as JSON, along with details of the machine they
+        were found on.
+
+        :param results: The list of results from run.
+        :param filename: The name of the JSON file.
+        """
+
+        report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'python': platform.python_version(),
+                  'numpy': np.__version__,
+                  'machine': platform.platform(),
+                  'cpus': os.cpu_count(),
+                  'results': results}
+        with open(filename, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    def compare(self, results, filename, tolerance=0.2):
+        """
+        Compares the results against a baseline saved by save.
+
+        :param results: The list of results from run.
+        :param filename: The name of the baseline JSON file.
+        :param tolerance: The fraction by which a benchmark may slow down
+                          before it counts as a regression.
+        :return: A list of (name, size, steps, baseline time, new time) for
+                 each benchmark which has slowed down by more than the
+                 tolerance.
+        """
+
+        with open(filename) as handle:
+            baseline = json.load(handle)['results']
+        times = {(result['name'], result['size'], result['steps']):
+                 result['wall_time'] for result in baseline}
+
+        regressions = []
+        for result in results:
+            key = (result['name'], result['size'], result['steps'])
+            if key in times and result['wall_time'] > (1 + tolerance) * \
+                    times[key]:
+                regressions.append(key + (times[key], result['wall_time']))
+
+        return regressions
+
+
+def map_size(text):
+    """
+    Reads a map size from the command line.
+
+    :param text: The size as it was given.
+    :return: The size, if it is large enough to benchmark.
+    """
+
+    size = int(text)
+    if size < BenchmarkSuite.smallest_size:
+        raise argparse.ArgumentTypeError(
+            'sizes must be at least {}'.format(BenchmarkSuite.smallest_size))
+
+    return size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=map_size, nargs='+',
+                        default=[15, 50, 200])
+    parser.add_argument('--steps', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--backends', nargs='+', default=None)
+    parser.add_argument('--output', default='benchmarks.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    arguments = parser.parse_args()
+
+    suite = BenchmarkSuite(arguments.sizes, arguments.steps,
+                           arguments.repeats, arguments.backends)
+    found = suite.run()
+    suite.save(found, arguments.output)
+
+    if arguments.baseline is not None:
+        for name, size, steps, before, after in suite.compare(
+                found, arguments.baseline, arguments.tolerance):
+            print('Regression in {} (size {}, {} steps): {:.4f} s -> {:.4f} s'
+                  .format(name, size, steps, before, after))
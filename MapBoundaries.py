@@ -0,0 +1,153 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains the boundary conditions which can be placed around the
+# outer edge of a Map. Each one fills the four edges of a Magic field at a
+# time step with whole-edge array operations, so the cost in Python calls
+# does not grow with the size of the map.
+
+import abc
+import os
+
+import numpy as np
+import h5py as h5
+
+
+class Boundary(abc.ABC):
+    """
+    This class is the base of every boundary condition. The outer edge of
+    the map is the first and last row and column of the buffered arrays,
+    leaving out the four corner points.
+    """
+
+    def edges(self, map_width):
+        """
+        Finds the left, right, top and bottom edges of the map.
+
+        :param map_width: The number of points across the region of interest.
+        :return: A list of the index of each edge into a single time slice.
+        """
+
+        w = map_width + 5
+        inner = slice(1, w)
+
+        return [(inner, 0), (inner, w), (0, inner), (w, inner)]
+
+    @abc.abstractmethod
+    def apply(self, aramour, magic_field, tstep, map_width):
+        """
+        Places the boundary conditions around a Magic field.
+
+        :param aramour: The Map the field belongs to.
+        :param magic_field: The Magic field which needs its BCs calculated.
+        :param tstep: The current time step.
+        :param map_width: The number of points across the region of interest.
+        """
+
+
+class StochasticBoundary(Boundary):
+    """
+    This class draws each edge from a skew-normal distribution centred on
+    the edge's values at the previous time step, as the Map always has.
+    """
+
+    def apply(self, aramour, magic_field, tstep, map_width):
+        w = map_width + 5
+        inner = slice(1, w)
+        previous = magic_field[tstep-1]
+        current = magic_field[tstep]
+        sampler = aramour.sampler
+
+        left = previous[inner, 0]
+        right = previous[inner, w]
+        top = previous[0, inner]
+
+        current[inner, 0] = sampler.rvs(0, loc=left, scale=10)
+        current[inner, w] = sampler.rvs(50/(100.1-right), loc=right, scale=15)
+        current[0, inner] = sampler.rvs(50/(100.1-top), loc=top, scale=15)
+
+        # The bottom edge has always been drawn around the top edge.
+        current[w, inner] = sampler.rvs(50/(100.1-top), loc=top, scale=15)
+
+
+class FixedBoundary(Boundary):
+    """
+    This class holds the edges at fixed values which do not change over
+    time.
+    """
+
+    def __init__(self, values):
+        """
+        :param values: Either a single value for every edge or an array the
+                       size of the map whose edges are used.
+        """
+
+        self.values = np.asarray(values, dtype=float)
+
+    def apply(self, aramour, magic_field, tstep, map_width):
+        current = magic_field[tstep]
+        values = np.broadcast_to(self.values, current.shape)
+        for edge in self.edges(map_width):
+            current[edge] = values[edge]
+
+
+class PeriodicBoundary(Boundary):
+    """
+    This class wraps the map around on itself, so each edge takes the values
+    just inside the opposite edge at the same time step.
+    """
+
+    def apply(self, aramour, magic_field, tstep, map_width):
+        w = map_width + 5
+        inner = slice(1, w)
+        current = magic_field[tstep]
+
+        current[inner, 0] = current[inner, w-1]
+        current[inner, w] = current[inner, 1]
+        current[0, inner] = current[w-1, inner]
+        current[w, inner] = current[1, inner]
+
+
+class FileBoundary(Boundary):
+    """
+    This class reads the edges at each time step from a file, such as one
+    written by Map.stream_map. Only the edges are read. If the run is longer
+    than the file, the file is started again from its first time step.
+    An HDF5 file is kept open until close is called, or until the end of a
+    with block.
+    """
+
+    def __init__(self, filename, field=None):
+        """
+        :param filename: The name of a .npy file holding an array whose first
+                         axis is time, or of an HDF5 file.
+        :param field: The name of the dataset to read from an HDF5 file, such
+                      as 'Light' or 'Dark'.
+        """
+
+        if os.fspath(filename).endswith('.npy'):
+            self.handle = None
+            self.values = np.load(filename, mmap_mode='r')
+        else:
+            self.handle = h5.File(filename, 'r')
+            self.values = self.handle[field]
+
+    def apply(self, aramour, magic_field, tstep, map_width):
+        current = magic_field[tstep]
+        frame = tstep % self.values.shape[0]
+        for edge in self.edges(map_width):
+            current[edge] = self.values[(frame,) + edge]
+
+    def close(self):
+        """ Closes the HDF5 file, if one is open. """
+
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,346 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains the ensemble runner, which runs many independent
+# realisations of a Map or RegionMap side by side and summarises them as
+# they go, so the history of every member never needs to be kept.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from MapFunctions import RegionMap
+from MapStructures import Map, TimeStore
+
+
+class EnsembleSummary:
+    """
+    This class holds the mean, spread and quantiles across the members of an
+    ensemble at each of the recorded time steps.
+    """
+
+    def __init__(self, times, frame_shape, quantiles):
+        """
+        :param times: The time steps which are recorded.
+        :param frame_shape: The shape of a single member at one time step.
+        :param quantiles: The quantiles which are recorded.
+        """
+
+        self.times = np.asarray(times)
+        self.quantiles = np.asarray(quantiles, dtype=float)
+        records = len(self.times)
+        self.mean = np.zeros((records,) + tuple(frame_shape))
+        self.spread = np.zeros((records,) + tuple(frame_shape))
+        self.quantile_fields = np.zeros((records, len(self.quantiles)) +
+                                        tuple(frame_shape))
+
+    def record(self, index, frames):
+        """
+        Summarises the members at one recorded time step.
+
+        :param index: The index of the recorded time step.
+        :param frames: An array holding every member at that time step, with
+                       the members along the first axis.
+        """
+
+        self.mean[index] = frames.mean(axis=0)
+        if frames.shape[0] > 1:
+            self.spread[index] = frames.std(axis=0, ddof=1)
+        self.quantile_fields[index] = np.quantile(frames, self.quantiles,
+                                                  axis=0)
+
+
+def new_region_member(seed, start, height, width):
+    """
+    Creates a member of a RegionMap ensemble, ready to find the start time
+    step. A member which starts after time 0 starts from an empty Map at the
+    time step before.
+
+    :param seed: The seed of the member's random stream.
+    :param start: The first time step to be found.
+    :param height: The number of points in the Map from north to south.
+    :param width: The number of points in the Map from east to west.
+    :return: The new member.
+    """
+
+    member = RegionMap(seed)
+    member.initialise_map(height, width, history='rolling')
+    if start > 0:
+        member.magics = TimeStore.resume(np.zeros((2, 12, height, width)),
+                                         start + 1, mode='rolling')
+
+    return member
+
+
+def new_map_member(seed, start, map_width, magic_value, dif_value, setup,
+                   dtype):
+    """
+    Creates a member of a Map ensemble, ready to calculate the start time
+    step. The initial values are placed at the time step before start.
+
+    :param seed: The seed of the member's random stream.
+    :param start: The first time step to calculate, at least 1.
+    :param map_width: The number of points across the region of interest.
+    :param magic_value: The starting value of the Magic fields.
+    :param dif_value: The starting value of the diffusion fields.
+    :param setup: A function which is given the member once its arrays are
+                  initialised, or None.
+    :param dtype: The type the member is stored as.
+    :return: The new member.
+    """
+
+    member = Map(seed)
+    member.prepare_map_arrays(map_width, history='rolling', dtype=dtype)
+    member.initialise_values(magic_value, dif_value)
+    member.create_next_time_step()
+    if setup is not None:
+        setup(member)
+    if start > 1:
+        for name in ['Light', 'Dark', 'LDPressure']:
+            field = getattr(member, name)
+            setattr(member, name, TimeStore.resume(
+                np.asarray(field), start + 1, field.capacity, 'rolling'))
+
+    return member
+
+
+def step_region_member(member, time, height, width, centre):
+    """ Finds one time step of a RegionMap member. """
+
+    member.step(time, height, width, centre)
+
+
+def step_map_member(member, tstep, map_width, backend):
+    """ Calculates one time step of a Map member and creates the next. """
+
+    member.step(tstep, map_width, backend=backend)
+    member.create_next_time_step()
+
+
+def region_frame(member, time):
+    """ :return: The 12 Magic fields of a RegionMap member at a time step. """
+
+    return member.magics[time]
+
+
+def map_frame(member, tstep):
+    """
+    :return: The Light, Dark and pressure fields of a Map member at a time
+             step, stacked in that order.
+    """
+
+    return np.stack([member.Light[tstep], member.Dark[tstep],
+                     member.LDPressure[tstep]])
+
+
+def run_member(seed, new_member, step_member, frame, start, stop, times):
+    """
+    Runs a single member from start to stop on its own, as is done in each
+    process of a process pool. Only the recorded time steps are kept.
+
+    :param seed: The seed of the member's random stream.
+    :param new_member: A function which creates a member from its seed.
+    :param step_member: A function which advances a member by a time step.
+    :param frame: A function which finds the fields of a member to record.
+    :param start: The first time step.
+    :param stop: The time step to stop before.
+    :param times: The time steps to record.
+    :return: An array of the recorded fields, with time along the first
+             axis.
+    """
+
+    member = new_member(seed)
+    frames = []
+    for time in range(start, stop):
+        step_member(member, time)
+        if time in times:
+            frames.append(np.array(frame(member, time)))
+
+    return np.stack(frames)
+
+
+class Ensemble:
+    """
+    This class runs a number of independent stochastic realisations, or
+    members, of a Map or RegionMap. Every member has its own random stream
+    spawned from a single seed, so an ensemble can be reproduced while its
+    members stay independent.
+
+    On threads, the members are advanced together one time step at a time
+    and only their last time steps are kept. On a pool of processes, each
+    process runs whole members on its own and sends back only the recorded
+    time steps. Either way the summary is the same.
+    """
+
+    def __init__(self, members, seed=None, quantiles=(0.1, 0.5, 0.9),
+                 workers=None, processes=False):
+        """
+        :param members: The number of members in the ensemble.
+        :param seed: The seed from which the stream of every member is
+                     spawned.
+        :param quantiles: The quantiles to record across the members.
+        :param workers: The number of threads or processes which run the
+                        members in parallel. Defaults to the number of CPUs.
+        :param processes: If True, run the members on a pool of processes
+                          rather than threads. Any setup function given to
+                          run_maps must then be picklable, such as a function
+                          defined at the top level of a module.
+        """
+
+        if members < 1:
+            raise ValueError('an ensemble needs at least one member')
+
+        self.members = members
+        self.seeds = np.random.SeedSequence(seed).spawn(members)
+        self.quantiles = quantiles
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        self.pool = None
+
+    def record_times(self, start, stop, record_every):
+        """
+        Finds the time steps at which the members are summarised. The last
+        time step is always recorded.
+
+        :param start: The starting time step.
+        :param stop: The final time step.
+        :param record_every: The number of time steps between records, or
+                             None to record only the last time step.
+        :return: A list of the recorded time steps.
+        """
+
+        if stop <= start:
+            raise ValueError('stop must be after start')
+        if record_every is None:
+            return [stop - 1]
+
+        times = list(range(start, stop, record_every))
+        if times[-1] != stop - 1:
+            times.append(stop - 1)
+
+        return times
+
+    def advance(self, members, advance_member):
+        """
+        Advances every member by one time step, in parallel if more than one
+        worker is used.
+
+        :param members: The list of members.
+        :param advance_member: A function which advances a single member.
+        """
+
+        if self.workers > 1:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            list(self.pool.map(advance_member, members))
+        else:
+            for member in members:
+                advance_member(member)
+
+    def run(self, new_member, step_member, frame, start, stop, frame_shape,
+            record_every):
+        """
+        Runs every member from the start to the stop time step and summarises
+        them at the recorded time steps.
+
+        :param new_member: A function which creates a member from its seed.
+        :param step_member: A function which advances a member by a time step.
+        :param frame: A function which finds the fields of a member to record.
+        :param start: The first time step.
+        :param stop: The time step to stop before.
+        :param frame_shape: The shape of the recorded fields of one member.
+        :param record_every: The number of time steps between records, or
+                             None to record only the last time step.
+        :return: An EnsembleSummary of the recorded fields.
+        """
+
+        times = self.record_times(start, stop, record_every)
+        summary = EnsembleSummary(times, frame_shape, self.quantiles)
+
+        if self.processes:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                runs = list(pool.map(partial(
+                    run_member, new_member=new_member,
+                    step_member=step_member, frame=frame, start=start,
+                    stop=stop, times=times), self.seeds))
+            for index in range(len(times)):
+                summary.record(index, np.stack([run[index] for run in runs]))
+            return summary
+
+        members = [new_member(seed) for seed in self.seeds]
+        index = 0
+        for time in range(start, stop):
+            self.advance(members, lambda member: step_member(member, time))
+            if time == times[index]:
+                summary.record(index, np.stack([frame(member, time)
+                                                for member in members]))
+                index += 1
+
+        return summary
+
+    def run_region_maps(self, start, stop, height, width, centre,
+                        record_every=None):
+        """
+        Runs every member as a RegionMap from the start to the stop time
+        step.
+
+        :param start: The starting time step. Members which start after time
+                      0 start from an empty Map.
+        :param stop: The final time step.
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param record_every: The number of time steps between records, or
+                             None to record only the last time step.
+        :return: An EnsembleSummary of the 12 Magic fields.
+        """
+
+        if start < 0:
+            raise ValueError('start must not be negative')
+
+        return self.run(
+            partial(new_region_member, start=start, height=height,
+                    width=width),
+            partial(step_region_member, height=height, width=width,
+                    centre=centre),
+            region_frame, start, stop, (12, height, width), record_every)
+
+    def run_maps(self, start, stop, map_width, magic_value=-1, dif_value=-1,
+                 setup=None, record_every=None, backend='numpy', dtype=float):
+        """
+        Runs every member as a Map from the start to the stop time step.
+
+        :param start: The first time step to calculate. The initial values
+                      are placed at the time step before, so this must be at
+                      least 1.
+        :param stop: The time step to stop before.
+        :param map_width: The number of points across the region of interest.
+        :param magic_value: The starting value of the Magic fields.
+        :param dif_value: The starting value of the diffusion fields.
+        :param setup: A function which is given each member once its arrays
+                      are initialised, to put any initial disturbances in
+                      place. Time 0 holds the initial values when it is
+                      called.
+        :param record_every: The number of time steps between records, or
+                             None to record only the last time step.
+        :param backend: Either 'numpy', 'numba' or 'sparse'.
+        :param dtype: Either np.float64 or np.float32, the type each member
+                      is stored as.
+        :return: An EnsembleSummary of the Light, Dark and pressure fields,
+                 stacked in that order.
+        """
+
+        if start < 1:
+            raise ValueError('start must be at least 1, since the initial '
+                             'values are held at the time step before it')
+
+        size = map_width + 6
+        return self.run(
+            partial(new_map_member, start=start, map_width=map_width,
+                    magic_value=magic_value, dif_value=dif_value, setup=setup,
+                    dtype=dtype),
+            partial(step_map_member, map_width=map_width, backend=backend),
+            map_frame, start, stop, (3, size, size), record_every)
@@ -1,14 +1,98 @@
 # Author: Jack Adams
 # Date Started: 18/06/3
-# Last Updated: 18/06/3
+# Last Updated: 26/10/16
 
 # This file contains the functions which will generate intensity values for
 # different types of Magic depending on the terrain of the Map.
 
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import numpy as np
-from scipy.stats import skewnorm
 import h5py as h5
 
+from MapSampling import SkewNormSampler
+from MapStorage import StreamWriter, save_checkpoint, load_checkpoint
+from MapProfiling import NullProfiler, ProgressReporter
+from MapStructures import TimeStore
+
+
+class RegionGeometry:
+    """
+    This class holds the fields which depend only on the size of the Map and
+    the epicentre of Light, such as the distance from the epicentre and the
+    locations and scales used to generate each type of Magic. These are
+    worked out once and shared between every time step. Fields which only
+    vary from north to south or from east to west are kept as a single
+    column or row.
+    """
+
+    # Geometries which have already been worked out, keyed on the height,
+    # width and centre of the Map.
+    cache = {}
+    cache_size = 8
+
+    def __init__(self, height, width, centre):
+        """
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        """
+
+        self.height = height
+        self.width = width
+        self.centre = tuple(np.ravel(centre))
+
+        # The distance of every point from the epicentre of Light, and the
+        # decay of Light and Dark Magic with that distance. Light uses the
+        # distance rounded to the nearest point.
+        y, x = np.indices((height, width))
+        self.distance = np.sqrt((self.centre[0] - y) ** 2
+                                + (self.centre[1] - x) ** 2)
+        self.light_distance = np.round(self.distance)
+        self.light_decay = np.exp((-0.6931 / width) * self.light_distance)
+        self.dark_decay = np.exp((-0.6931 / width) * self.distance)
+
+        # Heat and Fire decay from north to south, while Cold and Ice grow.
+        y = np.arange(height, dtype=float)[:, np.newaxis]
+        self.decay_loc_y = np.exp(1.1939 - ((1.5506 * y) / width))
+        self.decay_scale_y = np.exp(-0.6931 - ((0.6932 * y) / width))
+        self.growth_loc_y = np.exp(-0.3567 + ((1.5506 * y) / height))
+        self.growth_scale_y = np.exp(-1.3863 + ((0.6932 * y) / height))
+
+        # Serc, Romond, Dren and Vaelf decay or grow from west to east.
+        x = np.arange(width, dtype=float)
+        self.decay_loc_x = np.exp(1.1939 - ((1.5506 * x) / width))
+        self.growth_loc_x = np.exp(-0.3567 + ((1.5506 * x) / width))
+        self.decay_scale_x = np.exp(-0.6931 - ((0.6932 * x) / width))
+        self.growth_scale_x = np.exp(-1.3863 + ((0.6932 * x) / width))
+
+        # The fields are shared, so guard them against being changed.
+        for field in vars(self).values():
+            if isinstance(field, np.ndarray):
+                field.flags.writeable = False
+
+    @classmethod
+    def for_map(cls, height, width, centre):
+        """
+        Finds the geometry of a Map, only working it out if it is not already
+        held in the cache.
+
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :return: The RegionGeometry of the Map.
+        """
+
+        key = (height, width, tuple(np.ravel(centre).tolist()))
+        if key not in cls.cache:
+            if len(cls.cache) >= cls.cache_size:
+                cls.cache.pop(next(iter(cls.cache)))
+            cls.cache[key] = cls(height, width, centre)
+
+        return cls.cache[key]
+
 
 class RegionMap:
     """
@@ -18,9 +102,45 @@ class RegionMap:
     the next state of the Magic across the Map too.
     """
 
-    def __init__(self):
+    # The profiler which times each phase of a time step. See MapProfiling.
+    profiler = NullProfiler()
+
+    # The families of Magic found in each time step, along with the families
+    # each one needs to have been found first. Shadow is found from the Light
+    # and Dark, while every other family only depends on the previous time
+    # step, so they can all be found at the same time.
+    families = (('light', ()), ('dark', ()), ('shadow', ('light', 'dark')),
+                ('waxing', ()), ('heat', ()), ('cold', ()), ('wind', ()),
+                ('remainder', ()))
+
+    # The pools of threads which find the families of Magic, and the blocks
+    # of rows within a family, in parallel. Each is kept as (pool, size) and
+    # keyed by what it is used for, so that a family waiting on its blocks
+    # never takes up a thread its own blocks need. The lock guards starting
+    # a pool, since a pool may be asked for from more than one thread.
+    pools = None
+    pool_lock = threading.Lock()
+
+    # The number of rows in each block when the rows of a field are found in
+    # parallel. The blocks do not depend on the number of workers, so
+    # neither do the values drawn.
+    block_rows = 32
+
+    def __init__(self, seed=None):
+        """
+        :param seed: The seed for the random numbers used to generate Magic,
+                     so that a run can be reproduced.
+        """
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+
         self.terrain = None
         self.magics = None
+        self.handle = None
+        self.sampler = SkewNormSampler(seed)
+        self.seed = seed
+        self.family_samplers = None
 
     def save_map(self, filename, centre):
         """"""
@@ -30,26 +150,133 @@ class RegionMap:
         filename = filename + '.h5'
         h5handle = h5.File(filename, 'w')
 
-        # Now store the magic and centre data.
-        h5handle.create_dataset('magic_arrays', data=self.magics)
+        # Now store the magic and centre data. Only the time steps which are
+        # still held are saved if the Map keeps a rolling history or was
+        # resumed from a checkpoint.
+        h5handle.create_dataset('magic_arrays', data=np.asarray(self.magics))
         h5handle.create_dataset('centre_location', data=centre)
 
         # Lastly close the file handle.
         h5handle.close()
 
-    def load_map(self, filename):
-        """"""
+    def stream_map(self, filename, height, width, centre, compression=None,
+                   resume_at=None):
+        """
+        Opens a file which the Magic is written into one time step at a time
+        as it is found, rather than all at once at the end of the run. The
+        file uses the same layout as save_map, but holds only the time steps
+        which have been completed, so it can still be read by load_map if
+        the run stops part way.
+
+        :param filename: The name of the file, without its extension.
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param compression: The HDF5 compression filter to use, such as
+                            'gzip' or 'lzf', or None for no compression.
+        :param resume_at: If given, carry on writing the file from this time
+                          step, as when restarting from a checkpoint.
+        :return: The StreamWriter to give to find_magic.
+        """
+
+        writer = StreamWriter(filename + '.h5',
+                              {'magic_arrays': ((12, height, width),
+                                                self.magics.dtype)},
+                              compression=compression, resume_at=resume_at)
+        if resume_at is None:
+            writer.add_static('centre_location', centre)
+
+        return writer
+
+    def save_checkpoint(self, filename, time, centre):
+        """
+        Saves the smallest state needed to carry on the run exactly: the
+        last two time steps of Magic, the terrain, the centre and the state
+        of the random number generator.
+
+        :param filename: The name of the checkpoint file, without its
+                         extension.
+        :param time: The next time step to be found.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        """
+
+        first = max(self.magics.first_time, len(self.magics) - 2)
+        save_checkpoint(filename + '.h5',
+                        {'magic_arrays': self.magics[first:],
+                         'terrain': self.terrain,
+                         'centre_location': centre},
+                        {'time': time,
+                         'length': len(self.magics),
+                         'history': self.magics.mode,
+                         'capacity': self.magics.capacity,
+                         'sampler_state': self.sampler.get_state(),
+                         'family_states': json.dumps(
+                             {name: sampler.get_state() for name, sampler
+                              in (self.family_samplers or {}).items()})})
+
+    def load_checkpoint(self, filename):
+        """
+        Restores the Map from a checkpoint saved by save_checkpoint, so that
+        find_magic can carry on from where it was saved.
+
+        :param filename: The name of the checkpoint file, without its
+                         extension.
+        :return: The height and width of the Map, the next time step to be
+                 found and the centre of the Light.
+        """
+
+        fields, attributes = load_checkpoint(filename + '.h5')
+        capacity = attributes['capacity']
+        if attributes['history'] == 'chunked':
+            capacity = None
+        self.magics = TimeStore.resume(fields['magic_arrays'],
+                                       attributes['length'], capacity,
+                                       attributes['history'])
+        self.terrain = fields['terrain']
+        self.sampler.set_state(attributes['sampler_state'])
+        family_states = json.loads(attributes.get('family_states', '{}'))
+        if family_states:
+            for name, sampler in self.family_streams().items():
+                sampler.set_state(family_states[name])
+        [a, b, height, width] = self.magics.shape
+
+        return height, width, attributes['time'], fields['centre_location']
+
+    def load_map(self, filename, lazy=False):
+        """
+        Loads a Map saved by save_map or stream_map.
+
+        :param filename: The name of the file, without its extension.
+        :param lazy: If False, read the whole history into memory. If True,
+                     keep the file open and back the Magic arrays with the
+                     dataset, so only the slices which are asked for are
+                     read. If 'mmap', memory map the dataset instead where
+                     it is stored contiguously and uncompressed, as save_map
+                     stores it. A lazily loaded Map is read-only and should
+                     be closed with close_map.
+        :return: The height and width of the Map and the number of time
+                 steps in the file.
+        """
 
         # First prepare the filename for reading and then open the file handle.
         filename = filename + '.h5'
+        self.close_map()
         h5handle = h5.File(filename, 'r')
+        dataset = h5handle['magic_arrays']
 
-        # Now extract the data into the map.
-        self.magics = h5handle['magic_arrays'][:]
-        centre = h5handle['centre_location'][:]
-
-        # Lastly close the file handle.
-        h5handle.close()
+        # Now extract the data into the map, or leave it in the file.
+        if not lazy:
+            self.magics = TimeStore.from_array(dataset[:])
+            h5handle.close()
+        else:
+            self.handle = h5handle
+            self.magics = dataset
+            offset = dataset.id.get_offset()
+            if (lazy == 'mmap' and dataset.chunks is None and
+                    dataset.compression is None and offset is not None):
+                self.magics = np.memmap(filename, dtype=dataset.dtype,
+                                        mode='r', offset=offset,
+                                        shape=dataset.shape)
 
         # Extract addtional information about the height and width of the Map,
         # as well as the current time step.
@@ -60,20 +287,66 @@ class RegionMap:
 
         return height, width, time
 
-    def initialise_map(self, height, width):
+    def close_map(self):
+        """ Closes the file behind a lazily loaded Map, if there is one. """
+
+        if self.handle is not None:
+            self.magics = None
+            self.handle.close()
+            self.handle = None
+
+    def initialise_map(self, height, width, history='chunked', capacity=None,
+                       dtype=float):
         """
         Creates the arrays within the Map which are needed to store the values
         for the Magic intensities.
 
         :param height: The number of points in the Map from north to south.
         :param width: The number of points in the Map from east to west.
+        :param history: How the Magic arrays are kept over time; 'chunked'
+                        keeps every time step, 'rolling' keeps only the last
+                        `capacity` steps.
+        :param capacity: The number of time steps to allocate space for.
+                         Defaults to the two steps the generators need for a
+                         rolling history.
+        :param dtype: The data type the Magic is stored as. Every value is a
+                      whole number between 0 and 4 once it has been found, so
+                      np.uint8 stores the Magic exactly in an eighth of the
+                      memory and file space of the default float.
         """
 
         self.terrain = np.zeros([1, height, width])
-        self.magics = np.zeros([1, 12, height, width])
+        self.magics = TimeStore((12, height, width), capacity, history, dtype)
+        self.magics.append()
 
-    def print_region(self, time, ystart, ystop, xstart, xstop):
-        """"""
+    def print_region(self, time, ystart, ystop, xstart, xstop, magic=None):
+        """
+        Prints the Magic in a rectangular part of the Map at one time step.
+        Only that part is read when the Map was loaded lazily.
+
+        :param time: The time step to print.
+        :param ystart: The first row of the region.
+        :param ystop: The row to stop before.
+        :param xstart: The first column of the region.
+        :param xstop: The column to stop before.
+        :param magic: The index of a single type of Magic to print, or None
+                      to print all of them.
+        :return: The values which were printed.
+        """
+
+        if magic is None:
+            region = np.asarray(self.magics[time, :, ystart:ystop,
+                                            xstart:xstop])
+            for index in range(region.shape[0]):
+                print('Magic {} at time {}:'.format(index, time))
+                print(region[index])
+        else:
+            region = np.asarray(self.magics[time, magic, ystart:ystop,
+                                            xstart:xstop])
+            print('Magic {} at time {}:'.format(magic, time))
+            print(region)
+
+        return region
 
     def create_next_time(self, height, width):
         """
@@ -84,10 +357,14 @@ class RegionMap:
         :param width: The number of points in the Map from east to west.
         """
 
-        self.magics = np.append(self.magics, np.zeros([1, 12, height, width]),
-                                axis=0)
+        if isinstance(self.magics, np.ndarray):
+            self.magics = TimeStore.from_array(self.magics)
+        self.magics.append()
 
-    def find_magic(self, start, stop, height, width, centre):
+    def find_magic(self, start, stop, height, width, centre, vectorised=True,
+                   writer=None, checkpoint=None, checkpoint_every=100,
+                   profiler=None, progress=True, workers=None,
+                   block_workers=None):
         """
         This is the master-method for finding how the Magic changes over time.
         It will be run for a number of time steps between the inputs start and
@@ -99,55 +376,358 @@ class RegionMap:
         :param stop: The final time step.
         :param height: The number of points in the Map from north to south.
         :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param vectorised: If True, find each type of Magic across the whole
+                           Map at once. Otherwise step through the Map one
+                           point at a time.
+        :param writer: A StreamWriter from stream_map, which each time step
+                       is written to as soon as it is found.
+        :param checkpoint: The name of a checkpoint file, without its
+                           extension, to save the run to as it goes. The run
+                           can be restarted with load_checkpoint.
+        :param checkpoint_every: The number of time steps between
+                                 checkpoints. A checkpoint is always saved
+                                 after the last time step.
+        :param profiler: A Profiler from MapProfiling, which times each phase
+                         of every time step.
+        :param progress: If True, report the time step now and then. A
+                         function of (time, stop) can be given to report
+                         progress some other way, or False for none.
+        :param workers: If given, find the families of Magic at the same
+                        time on this many threads, each family drawing from
+                        its own random number stream. See find_families.
+        :param block_workers: If given, split the rows of the Heat, Cold,
+                              Wind and remainder Magics between this many
+                              threads. See draw_field.
         """
 
-        for time in range(start, stop):
+        if progress is True:
+            progress = ProgressReporter()
+        previous = self.profiler
+        if profiler is not None:
+            self.profiler = profiler
+            profiler.start()
+
+        try:
+            for time in range(start, stop):
+
+                if profiler is not None:
+                    profiler.begin_step(time)
+                self.step(time, height, width, centre, vectorised, workers,
+                          block_workers)
+                if writer is not None:
+                    with self.profiler.phase('write'):
+                        writer.append(magic_arrays=self.magics[time])
+                if checkpoint is not None and ((time + 1 - start) %
+                                               checkpoint_every == 0 or
+                                               time == stop - 1):
+                    with self.profiler.phase('checkpoint'):
+                        self.save_checkpoint(checkpoint, time + 1, centre)
+                if profiler is not None:
+                    profiler.end_step(time, 12 * height * width)
+                if progress:
+                    progress(time, stop)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                self.profiler = previous
+
+    def step(self, time, height, width, centre, vectorised=True,
+             workers=None, block_workers=None):
+        """
+        Finds the Magic across the Map for a single time step and then
+        creates the next time step.
 
-            print('Time = {}'.format(time))
+        :param time: The time step to find the Magic at.
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param vectorised: If True, find each type of Magic across the whole
+                           Map at once.
+        :param workers: If given, find the families of Magic at the same
+                        time on this many threads.
+        :param block_workers: If given, split the rows of the Heat, Cold,
+                              Wind and remainder Magics between this many
+                              threads.
+        """
+
+        # Magic stored compactly as whole numbers is found in a floating
+        # point copy of the last two time steps, since the values drawn can
+        # fall outside 0 to 4 until they are clamped.
+        compact = self.magics
+        if np.issubdtype(compact.dtype, np.integer):
+            first = max(compact.first_time, time - 1)
+            self.magics = TimeStore.resume(compact[first:time + 1]
+                                           .astype(float), time + 1,
+                                           mode='rolling')
+
+        try:
             # To start with, place the boundary conditions for all the
             # types of Magic which require it.
-            self.initialise_BCs(height, width, time)
+            with self.profiler.phase('boundaries'):
+                self.initialise_BCs(height, width, time)
 
             # For the arrays of Magic, each call their respective generation
             # functions.
-            for i in range(height):
-                for j in range(width):
-                    # First deal with the Light, Dark and Shadow Magics which
-                    # come from the epicentre specified in the following calls.
-                    self.gen_light_value(width, centre, time, i, j)
-                    self.gen_dark_value(width, centre, time, i, j)
-                    self.calculate_shadow(time, i, j)
-
-                    # After those, find if there are any points which massive
-                    # bursts of Waxing Magic.
-                    self.gen_waxing_burst(time, i, j)
-
-                    # Next, find the heat and cold Magics which emanate from
-                    # the north and south respectively.
-                    if i is not 0:
-                        self.gen_heat_and_fire(height, width, time, i, j)
-
-                    if i != height-1:
-                        self.gen_cold_and_ice(height, width, time, i, j)
-
-                    # Then find the Serc and Romond Magics which have complex
-                    # functions to do with their terrain/location.
-                    if j is not 0:
-                        self.gen_wind_and_water(height, width, time, i, j)
-
-                    # And lastly find the other types of Magic; Dren and Vaelf.
-                    if j is not 0:
-                        self.gen_remainder(height, width, time, i, j)
-
-                    for k in range(12):
-                        if self.magics[time, k, i, j] < 0:
-                            self.magics[time, k, i, j] = 0
-                        elif self.magics[time, k, i, j] > 4:
-                            self.magics[time, k, i, j] = 4
-
-            # Lastly create the next time step.
+            if vectorised:
+                self.calculate_magic_step(height, width, centre, time,
+                                          workers, block_workers)
+            else:
+                with self.profiler.phase('points'):
+                    self.calculate_magic_points(height, width, centre, time)
+
+            if self.magics is not compact:
+                compact[time] = self.magics[time]
+        finally:
+            self.magics = compact
+
+        # Lastly create the next time step.
+        with self.profiler.phase('create_next_time'):
             self.create_next_time(height, width)
 
+    def calculate_magic_points(self, height, width, centre, time):
+        """
+        Finds the value of every type of Magic at one time step by stepping
+        through the Map one point at a time.
+
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        """
+
+        # The averages over the previous time step are found once for the
+        # whole Map rather than once per point.
+        averages = self.find_average_fields(time-1) if time > 0 else {}
+
+        for i in range(height):
+            for j in range(width):
+                # First deal with the Light, Dark and Shadow Magics which
+                # come from the epicentre specified in the following calls.
+                self.gen_light_value(width, centre, time, i, j)
+                self.gen_dark_value(width, centre, time, i, j)
+                self.calculate_shadow(time, i, j)
+
+                # After those, find if there are any points which massive
+                # bursts of Waxing Magic.
+                self.gen_waxing_burst(time, i, j)
+
+                # Next, find the heat and cold Magics which emanate from
+                # the north and south respectively.
+                if i != 0:
+                    self.gen_heat_and_fire(height, width, time, i, j,
+                                           averages.get('heat'))
+
+                if i != height-1:
+                    self.gen_cold_and_ice(height, width, time, i, j,
+                                          averages.get('cold'))
+
+                # Then find the Serc and Romond Magics which have complex
+                # functions to do with their terrain/location.
+                if j != 0:
+                    self.gen_wind_and_water(height, width, time, i, j,
+                                            averages.get('wind'))
+
+                # And lastly find the other types of Magic; Dren and Vaelf.
+                if j != 0:
+                    self.gen_remainder(height, width, time, i, j,
+                                       averages.get('remainder'))
+
+                for k in range(12):
+                    if self.magics[time, k, i, j] < 0:
+                        self.magics[time, k, i, j] = 0
+                    elif self.magics[time, k, i, j] > 4:
+                        self.magics[time, k, i, j] = 4
+
+    def calculate_magic_step(self, height, width, centre, time, workers=None,
+                             block_workers=None):
+        """
+        Finds the value of every type of Magic at one time step using whole
+        array operations across the Map. The same rules are used as when
+        stepping through the Map one point at a time.
+
+        :param height: The number of points in the Map from north to south.
+        :param width: The number of points in the Map from east to west.
+        :param centre: The y-x coordinates of the Light's epicentre.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        :param workers: If None, find the families one after another from
+                        the Map's own sampler. Otherwise find them with
+                        find_families on this many threads.
+        :param block_workers: If given, split the rows of the Heat, Cold,
+                              Wind and remainder Magics between this many
+                              threads with draw_field.
+        """
+
+        phase = self.profiler.phase
+        magics = self.magics[time]
+        with phase('averages'):
+            geometry = RegionGeometry.for_map(height, width, centre)
+            averages = self.find_average_fields(time-1) if time > 0 else {}
+
+        # The pool for the blocks of rows is found before any family starts,
+        # so it is never resized while a family is using it.
+        pool = None
+        if block_workers is not None:
+            pool = self.thread_pool(block_workers, 'blocks')
+
+        generators = {
+            'light': lambda sampler: self.gen_light_field(
+                magics, geometry, time, sampler),
+            'dark': lambda sampler: self.gen_dark_field(
+                magics, geometry, time, sampler),
+            'shadow': lambda sampler: self.calculate_shadow_field(magics),
+            'waxing': lambda sampler: self.gen_waxing_field(magics, sampler),
+            'heat': lambda sampler: self.gen_heat_and_fire_field(
+                magics, geometry, time, averages.get('heat'), sampler,
+                pool),
+            'cold': lambda sampler: self.gen_cold_and_ice_field(
+                magics, geometry, time, averages.get('cold'), sampler,
+                pool),
+            'wind': lambda sampler: self.gen_wind_and_water_field(
+                magics, geometry, time, averages.get('wind'), sampler,
+                pool),
+            'remainder': lambda sampler: self.gen_remainder_field(
+                magics, geometry, time, averages.get('remainder'), sampler,
+                pool)}
+
+        if workers is None:
+            for name, needs in self.families:
+                with phase(name):
+                    generators[name](self.sampler)
+        else:
+            self.find_families(generators, workers)
+
+        # Every type of Magic is kept between 0 and 4.
+        with phase('clamp'):
+            np.clip(magics, 0, 4, out=magics)
+
+    def family_streams(self):
+        """
+        Finds the samplers of each family of Magic which draws random values.
+        Each is given its own stream spawned from the Map's seed, so the
+        values a family draws do not depend on the order the families are
+        found in.
+
+        :return: A dictionary of the sampler of each family, keyed by name.
+        """
+
+        if self.family_samplers is None:
+            names = [name for name, needs in self.families if name != 'shadow']
+            self.family_samplers = {
+                name: SkewNormSampler(seed)
+                for name, seed in zip(names, self.seed.spawn(len(names)))}
+
+        return self.family_samplers
+
+    def thread_pool(self, workers, purpose='families'):
+        """
+        Finds a pool of threads of the given size, only starting a new pool
+        if the size has changed. The pools are only resized between time
+        steps, never while one of them is in use.
+
+        :param workers: The number of threads in the pool.
+        :param purpose: What the pool is used for, either 'families' or
+                        'blocks'.
+        :return: The pool of threads.
+        """
+
+        with self.pool_lock:
+            if self.pools is None:
+                self.pools = {}
+            pool, size = self.pools.get(purpose, (None, 0))
+            if pool is None or size != workers:
+                if pool is not None:
+                    pool.shutdown()
+                pool = ThreadPoolExecutor(max_workers=workers)
+                self.pools[purpose] = (pool, workers)
+
+        return pool
+
+    def draw_field(self, out, sampler, a, loc, scale, pool=None):
+        """
+        Draws skew-normal values across a field, rounds them to whole numbers
+        and places them in out. Given a pool, the rows are split into blocks
+        of block_rows, each found on its own thread from its own random
+        stream. The streams are spawned from a single value drawn from the
+        sampler, so the values found are the same whatever the size of the
+        pool, though not the same as when the field is found in one go.
+        Every point only depends on the previous time step, so the blocks
+        can be found independently.
+
+        :param out: The part of the Magic array at the current time step to
+                    fill.
+        :param sampler: The sampler to draw from.
+        :param a: The shape parameter, broadcastable to the shape of out.
+        :param loc: The location parameter.
+        :param scale: The scale parameter.
+        :param pool: A pool of threads to find the blocks on, or None to find
+                     the whole field at once.
+        """
+
+        if pool is None:
+            out[...] = np.round(sampler.rvs(a, loc=loc, scale=scale,
+                                            size=out.shape))
+            return
+
+        a, loc, scale = np.broadcast_arrays(a, loc, scale, out)[:3]
+        starts = range(0, out.shape[0], self.block_rows)
+        seeds = np.random.SeedSequence(sampler.rng.integers(2**63))\
+            .spawn(len(starts))
+
+        def find(first, seed):
+            rows = slice(first, first + self.block_rows)
+            rng = np.random.default_rng(seed)
+            shape = out[rows].shape
+            u0 = rng.standard_normal(shape)
+            v = rng.standard_normal(shape)
+            out[rows] = np.round(sampler.transform(a[rows], loc[rows],
+                                                   scale[rows], u0, v))
+
+        for future in [pool.submit(find, first, seed)
+                       for first, seed in zip(starts, seeds)]:
+            future.result()
+
+    def find_families(self, generators, workers):
+        """
+        Finds the families of Magic at one time step, starting each family
+        on a pool of threads as soon as the families it needs have been
+        found. Each family draws from its own stream, so the Magic found is
+        the same whatever the number of workers. The families share the
+        Magic array but each writes to its own types of Magic.
+
+        :param generators: A dictionary of the function which finds each
+                           family, given its sampler, keyed by name.
+        :param workers: The number of threads to use.
+        """
+
+        samplers = self.family_streams()
+
+        def find(name):
+            with self.profiler.phase(name):
+                generators[name](samplers.get(name))
+
+        if workers == 1:
+            for name, needs in self.families:
+                find(name)
+            return
+
+        pool = self.thread_pool(workers)
+        waiting = list(self.families)
+        found = set()
+        running = {}
+        while waiting or running:
+            for name, needs in list(waiting):
+                if found.issuperset(needs):
+                    running[pool.submit(find, name)] = name
+                    waiting.remove((name, needs))
+
+            finished, unfinished = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                found.add(running.pop(future))
+
     def initialise_BCs(self, height, width, time):
         """
         Put in place values for the boundary conditions of Magical values
@@ -160,31 +740,30 @@ class RegionMap:
         """
 
         # Start with the Heat and Cold BCs along the top and bottom edges since
-        # the Light, Dark, and Shadow Magics don't need BCs.
-        for i in range(width):
-            self.magics[time, 4, 0, i] = np.round(skewnorm.rvs(1, loc=3,
-                                                               scale=0.5))
-            self.magics[time, 5, height-1, i] = np.round(skewnorm.rvs(1, loc=3,
-                                                                      scale=0.5))
-
-            # Now do the Talon and Izeth BCs, which are along the top and
-            # bottom boundaries as well.
-            self.magics[time, 6, 0, i] = np.round(skewnorm.rvs(1, loc=3,
-                                                               scale=0.5))
-            self.magics[time, 7, height-1] = np.round(skewnorm.rvs(1, loc=3,
-                                                                   scale=0.5))
+        # the Light, Dark, and Shadow Magics don't need BCs. Each edge is drawn
+        # as a whole.
+        self.magics[time, 4, 0] = np.round(self.sampler.rvs(1, loc=3,
+                                                            scale=0.5,
+                                                            size=width))
+        self.magics[time, 5, height-1] = np.round(self.sampler.rvs(1, loc=3,
+                                                                   scale=0.5,
+                                                                   size=width))
+
+        # Now do the Talon and Izeth BCs, which are along the top and bottom
+        # boundaries as well.
+        self.magics[time, 6, 0] = np.round(self.sampler.rvs(1, loc=3,
+                                                            scale=0.5,
+                                                            size=width))
+        self.magics[time, 7, height-1] = np.round(self.sampler.rvs(1, loc=3,
+                                                                   scale=0.5,
+                                                                   size=width))
 
         # Now do the BCs for Dren, Romond, Serc, and Vaelf, all of which flow
         # from the left boundary.
-        for i in range(height):
-            self.magics[time, 8, i, 0] = np.round(skewnorm.rvs(1, loc=0.6,
-                                                               scale=0.3))
-            self.magics[time, 9, i, 0] = np.round(skewnorm.rvs(1, loc=3,
-                                                               scale=0.5))
-            self.magics[time, 10, i, 0] = np.round(skewnorm.rvs(1, loc=0.6,
-                                                                scale=0.3))
-            self.magics[time, 11, i, 0] = np.round(skewnorm.rvs(1, loc=3,
-                                                                scale=0.5))
+        for magic, loc, scale in [(8, 0.6, 0.3), (9, 3, 0.5), (10, 0.6, 0.3),
+                                  (11, 3, 0.5)]:
+            self.magics[time, magic, :, 0] = np.round(self.sampler.rvs(
+                1, loc=loc, scale=scale, size=height))
 
     def gen_light_value(self, width, centre, time, y, x):
         """
@@ -223,7 +802,7 @@ class RegionMap:
 
         value = (np.exp((-0.6931 / width) * distance) * (1.8 -
                  1.6 * np.cos(phase * local_time)) +
-                 skewnorm.rvs(skew_value, loc=0, scale=scale_value))
+                 self.sampler.rvs(skew_value, loc=0, scale=scale_value))
 
         self.magics[time, 0, y, x] = value.round()
 
@@ -263,7 +842,7 @@ class RegionMap:
 
         value = (np.exp((-0.6931 / width) * distance) * (1.8 -
                  np.cos(phase * local_time - np.pi)) +
-                 skewnorm.rvs(skew_value, loc=0, scale=scale_value))
+                 self.sampler.rvs(skew_value, loc=0, scale=scale_value))
 
         self.magics[time, 1, y, x] = value.round()
 
@@ -298,12 +877,12 @@ class RegionMap:
         :param x: The x-location of the given point.
         """
 
-        self.magics[time, 3, y, x] = np.round(skewnorm.rvs(4, loc=0, scale=1.4))
+        self.magics[time, 3, y, x] = np.round(self.sampler.rvs(4, loc=0, scale=1.4))
 
         if self.magics[time, 3, y, x] < 4:
             self.magics[time, 3, y, x] = 0
 
-    def gen_heat_and_fire(self, height, width, time, y, x):
+    def gen_heat_and_fire(self, height, width, time, y, x, averages=None):
         """
         Determines the value of both Heat and Fire Magic at a point given the
         values of the points nearby in the previous time step.
@@ -314,6 +893,9 @@ class RegionMap:
                      tracking.
         :param y: The y-location of the given point.
         :param x: The x-location of the given point.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, the averages are found for this
+                         point alone.
         """
 
         if time == 0:
@@ -327,13 +909,17 @@ class RegionMap:
             # Therefore use (-1.3863 + 0.6931) / height
             decay_scale = np.exp(-0.6931 - ((0.6932 * y) / width))
 
-            self.magics[time, 4, y, x] = np.round(skewnorm.rvs(0, loc=decay_loc,
-                                                               scale=decay_scale))
-            self.magics[time, 6, y, x] = np.round(skewnorm.rvs(0, loc=decay_loc,
-                                                               scale=decay_scale))
+            self.magics[time, 4, y, x] = np.round(self.sampler.rvs(0, loc=decay_loc,
+                                                                    scale=decay_scale))
+            self.magics[time, 6, y, x] = np.round(self.sampler.rvs(0, loc=decay_loc,
+                                                                    scale=decay_scale))
         else:
-            average1 = self.find_TB_average(width, time-1, 4, y, x)
-            average2 = self.find_TB_average(width, time-1, 6, y, x)
+            if averages is None:
+                average1 = self.find_TB_average(width, time-1, 4, y, x)
+                average2 = self.find_TB_average(width, time-1, 6, y, x)
+            else:
+                average1 = averages[0][y, x]
+                average2 = averages[1][y, x]
 
             decay_loc = np.exp(1.1939 - ((1.5506 * y) / width))
             skew_value1 = 3 * (average1 - decay_loc)
@@ -342,14 +928,14 @@ class RegionMap:
 
             seasonal_shift = 0.7 + 0.3 * np.cos(8.7266*(10**-4) * (time%7200))
 
-            self.magics[time, 4, y, x] = np.round(skewnorm.rvs(skew_value1,
-                                                               loc=decay_loc * seasonal_shift,
-                                                               scale=decay_scale))
-            self.magics[time, 6, y, x] = np.round(skewnorm.rvs(skew_value2,
-                                                               loc=decay_loc,
-                                                               scale=decay_scale))
+            self.magics[time, 4, y, x] = np.round(self.sampler.rvs(skew_value1,
+                                                                    loc=decay_loc * seasonal_shift,
+                                                                    scale=decay_scale))
+            self.magics[time, 6, y, x] = np.round(self.sampler.rvs(skew_value2,
+                                                                    loc=decay_loc,
+                                                                    scale=decay_scale))
 
-    def gen_cold_and_ice(self, height, width, time, y, x):
+    def gen_cold_and_ice(self, height, width, time, y, x, averages=None):
         """
         Determines the value of both Cold and Ice Magic at a point given the
         values of the points nearby in the previous time step.
@@ -360,6 +946,9 @@ class RegionMap:
                      tracking.
         :param y: The y-location of the given point.
         :param x: The x-location of the given point.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, the averages are found for this
+                         point alone.
         """
 
         if time == 0:
@@ -373,13 +962,17 @@ class RegionMap:
             # Therefore use (-1.3863 + 0.6931) / height
             growth_scale = np.exp(-1.3863 + ((0.6932 * y) / height))
 
-            self.magics[time, 5, y, x] = np.round(skewnorm.rvs(0, loc=growth_loc,
-                                                               scale=growth_scale))
-            self.magics[time, 7, y, x] = np.round(skewnorm.rvs(0, loc=growth_loc,
-                                                               scale=growth_scale))
+            self.magics[time, 5, y, x] = np.round(self.sampler.rvs(0, loc=growth_loc,
+                                                                    scale=growth_scale))
+            self.magics[time, 7, y, x] = np.round(self.sampler.rvs(0, loc=growth_loc,
+                                                                    scale=growth_scale))
         else:
-            average1 = self.find_BT_average(width, time-1, 4, y, x)
-            average2 = self.find_BT_average(width, time-1, 6, y, x)
+            if averages is None:
+                average1 = self.find_BT_average(width, time-1, 4, y, x)
+                average2 = self.find_BT_average(width, time-1, 6, y, x)
+            else:
+                average1 = averages[0][y, x]
+                average2 = averages[1][y, x]
 
             growth_loc = np.exp(-0.3567 + ((1.5506 * y) / height))
             skew_value1 = 3 * (average1 - growth_loc)
@@ -389,14 +982,14 @@ class RegionMap:
             seasonal_shift = 0.7 + 0.3 * np.cos(np.pi + 8.7266 * (10**-4)
                                                 * (time % 7200))
 
-            self.magics[time, 5, y, x] = np.round(skewnorm.rvs(skew_value1,
-                                                               loc=growth_loc * seasonal_shift,
-                                                               scale=growth_scale))
-            self.magics[time, 7, y, x] = np.round(skewnorm.rvs(skew_value2,
-                                                               loc=growth_loc,
-                                                               scale=growth_scale))
+            self.magics[time, 5, y, x] = np.round(self.sampler.rvs(skew_value1,
+                                                                    loc=growth_loc * seasonal_shift,
+                                                                    scale=growth_scale))
+            self.magics[time, 7, y, x] = np.round(self.sampler.rvs(skew_value2,
+                                                                    loc=growth_loc,
+                                                                    scale=growth_scale))
 
-    def gen_wind_and_water(self, height, width, time, y, x):
+    def gen_wind_and_water(self, height, width, time, y, x, averages=None):
         """
         Determines the values for the Magic of Serc and Romond given the values
         in the previous time step.
@@ -406,6 +999,9 @@ class RegionMap:
         :param time: The current time.
         :param y: The y-location of the given point.
         :param x: The x-location of the given point.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, the averages are found for this
+                         point alone.
         """
 
         if time == 0:
@@ -421,15 +1017,19 @@ class RegionMap:
             decay_scale = np.exp(-0.6931 - ((0.6932 * x) / width))
             growth_scale = np.exp(-1.3863 + ((0.6932 * x) / width))
 
-            self.magics[time, 9, y, x] = np.round(skewnorm.rvs(0,
-                                                               loc=decay_loc,
-                                                               scale=decay_scale))
-            self.magics[time, 10, y, x] = np.round(skewnorm.rvs(0,
-                                                                loc=growth_loc,
-                                                                scale=growth_scale))
+            self.magics[time, 9, y, x] = np.round(self.sampler.rvs(0,
+                                                                    loc=decay_loc,
+                                                                    scale=decay_scale))
+            self.magics[time, 10, y, x] = np.round(self.sampler.rvs(0,
+                                                                     loc=growth_loc,
+                                                                     scale=growth_scale))
         else:
-            log_avg = self.find_LR_average(height, time-1, 9, y, x)
-            exp_avg = self.find_LR_average(height, time-1, 10, y, x)
+            if averages is None:
+                log_avg = self.find_LR_average(height, time-1, 9, y, x)
+                exp_avg = self.find_LR_average(height, time-1, 10, y, x)
+            else:
+                log_avg = averages[0][y, x]
+                exp_avg = averages[1][y, x]
 
             decay_loc = np.exp(1.1939 - ((1.5506 * x) / width))
             growth_loc = np.exp(-0.3567 + ((1.5506 * x) / width))
@@ -438,14 +1038,14 @@ class RegionMap:
             decay_skew = 3 * (log_avg - decay_loc)
             growth_skew = 3 * (exp_avg - growth_loc)
 
-            self.magics[time, 9, y, x] = np.round(skewnorm.rvs(decay_skew,
-                                                               loc=decay_loc,
-                                                               scale=decay_scale))
-            self.magics[time, 10, y, x] = np.round(skewnorm.rvs(growth_skew,
-                                                                loc=growth_loc,
-                                                                scale=growth_scale))
+            self.magics[time, 9, y, x] = np.round(self.sampler.rvs(decay_skew,
+                                                                    loc=decay_loc,
+                                                                    scale=decay_scale))
+            self.magics[time, 10, y, x] = np.round(self.sampler.rvs(growth_skew,
+                                                                     loc=growth_loc,
+                                                                     scale=growth_scale))
 
-    def gen_remainder(self, height, width, time, y, x):
+    def gen_remainder(self, height, width, time, y, x, averages=None):
         """
         Finds the values for the Dren and Vaelf Magics depending on the Magic
         values from the previous time step.
@@ -455,6 +1055,9 @@ class RegionMap:
         :param time: The current time.
         :param y: The y-location of the given point.
         :param x: The x-location of the given point.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, the averages are found for this
+                         point alone.
         """
 
         if time == 0:
@@ -470,15 +1073,19 @@ class RegionMap:
             decay_scale = np.exp(-0.6931 - ((0.6932 * x) / width))
             growth_scale = np.exp(-1.3863 + ((0.6932 * x) / width))
 
-            self.magics[time, 8, y, x] = np.round(skewnorm.rvs(0,
-                                                               loc=growth_loc,
-                                                               scale=growth_scale))
-            self.magics[time, 11, y, x] = np.round(skewnorm.rvs(0,
-                                                                loc=decay_loc,
-                                                                scale=decay_scale))
+            self.magics[time, 8, y, x] = np.round(self.sampler.rvs(0,
+                                                                    loc=growth_loc,
+                                                                    scale=growth_scale))
+            self.magics[time, 11, y, x] = np.round(self.sampler.rvs(0,
+                                                                     loc=decay_loc,
+                                                                     scale=decay_scale))
         else:
-            log_avg = self.find_LR_average(height, time-1, 8, y, x)
-            exp_avg = self.find_LR_average(height, time-1, 11, y, x)
+            if averages is None:
+                log_avg = self.find_LR_average(height, time-1, 8, y, x)
+                exp_avg = self.find_LR_average(height, time-1, 11, y, x)
+            else:
+                log_avg = averages[0][y, x]
+                exp_avg = averages[1][y, x]
 
             decay_loc = np.exp(1.1939 - ((1.5506 * x) / width))
             growth_loc = np.exp(-0.3567 + ((1.5506 * x) / width))
@@ -487,12 +1094,371 @@ class RegionMap:
             decay_skew = 3 * (log_avg - decay_loc)
             growth_skew = 3 * (exp_avg - growth_loc)
 
-            self.magics[time, 8, y, x] = np.round(skewnorm.rvs(growth_skew,
-                                                               loc=growth_loc,
-                                                               scale=growth_scale))
-            self.magics[time, 11, y, x] = np.round(skewnorm.rvs(decay_skew,
-                                                                loc=decay_loc,
-                                                                scale=decay_scale))
+            self.magics[time, 8, y, x] = np.round(self.sampler.rvs(growth_skew,
+                                                                    loc=growth_loc,
+                                                                    scale=growth_scale))
+            self.magics[time, 11, y, x] = np.round(self.sampler.rvs(decay_skew,
+                                                                     loc=decay_loc,
+                                                                     scale=decay_scale))
+
+    def gen_light_field(self, magics, geometry, time, sampler=None):
+        """
+        Generates the intensity of Light Magic across the whole Map depending
+        on how far away each point is from the epicentre of Light.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        phase = 15 * np.pi / 180
+        local_time = (time % 24 + geometry.light_distance) % 24
+
+        offset = np.where(local_time < 12, 6 - local_time, local_time - 18)
+        skew_value = offset / 4
+        scale_value = 0.2 + np.abs(offset / 30)
+
+        value = (geometry.light_decay * (1.8 -
+                 1.6 * np.cos(phase * local_time)) +
+                 sampler.rvs(skew_value, loc=0, scale=scale_value))
+
+        magics[0] = value.round()
+
+    def gen_dark_field(self, magics, geometry, time, sampler=None):
+        """
+        Generates the intensity of Dark Magic across the whole Map depending
+        on how far away each point is from the epicentre of Light.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        phase = 15 * np.pi / 180
+        local_time = (time % 24 + geometry.distance) % 24
+
+        offset = np.where(local_time < 12, 6 - local_time, local_time - 18)
+        skew_value = -offset / 4
+        scale_value = 0.2 + np.abs(offset / 30)
+
+        value = (geometry.dark_decay * (1.8 -
+                 np.cos(phase * local_time - np.pi)) +
+                 sampler.rvs(skew_value, loc=0, scale=scale_value))
+
+        magics[1] = value.round()
+
+    def calculate_shadow_field(self, magics):
+        """
+        Finds the amount of Shadow Magic across the whole Map and adjusts the
+        Light and Dark Magics accordingly.
+
+        :param magics: The Magic arrays at the current time step.
+        """
+
+        np.minimum(magics[0], magics[1], out=magics[2])
+        magics[0] -= magics[2]
+        magics[1] -= magics[2]
+
+    def gen_waxing_field(self, magics, sampler=None):
+        """
+        Generates the points across the whole Map where Waxing Magic is
+        extremely strong.
+
+        :param magics: The Magic arrays at the current time step.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        waxing = np.round(sampler.rvs(4, loc=0, scale=1.4,
+                                      size=magics[3].shape))
+        waxing[waxing < 4] = 0
+        magics[3] = waxing
+
+    def gen_heat_and_fire_field(self, magics, geometry, time, averages=None,
+                                sampler=None, pool=None):
+        """
+        Determines the values of Heat and Fire Magic across every row of the
+        Map below the top boundary.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, they are found here.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        :param pool: A pool of threads to split the rows between. See
+                     draw_field.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        decay_loc = geometry.decay_loc_y[1:]
+        decay_scale = geometry.decay_scale_y[1:]
+
+        if time == 0:
+            self.draw_field(magics[4, 1:], sampler, 0, decay_loc,
+                            decay_scale, pool)
+            self.draw_field(magics[6, 1:], sampler, 0, decay_loc,
+                            decay_scale, pool)
+        else:
+            if averages is None:
+                averages = (self.find_TB_average_field(time-1, 4),
+                            self.find_TB_average_field(time-1, 6))
+            average1 = averages[0][1:]
+            average2 = averages[1][1:]
+
+            skew_value1 = 3 * (average1 - decay_loc)
+            skew_value2 = 3 * (average2 - decay_loc)
+            seasonal_shift = 0.7 + 0.3 * np.cos(8.7266*(10**-4) * (time%7200))
+
+            self.draw_field(magics[4, 1:], sampler, skew_value1,
+                            decay_loc * seasonal_shift, decay_scale, pool)
+            self.draw_field(magics[6, 1:], sampler, skew_value2, decay_loc,
+                            decay_scale, pool)
+
+    def gen_cold_and_ice_field(self, magics, geometry, time, averages=None,
+                               sampler=None, pool=None):
+        """
+        Determines the values of Cold and Ice Magic across every row of the
+        Map above the bottom boundary.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The value of time since the Map started its weather
+                     tracking.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, they are found here.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        :param pool: A pool of threads to split the rows between. See
+                     draw_field.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        growth_loc = geometry.growth_loc_y[:-1]
+        growth_scale = geometry.growth_scale_y[:-1]
+
+        if time == 0:
+            self.draw_field(magics[5, :-1], sampler, 0, growth_loc,
+                            growth_scale, pool)
+            self.draw_field(magics[7, :-1], sampler, 0, growth_loc,
+                            growth_scale, pool)
+        else:
+            if averages is None:
+                averages = (self.find_BT_average_field(time-1, 4),
+                            self.find_BT_average_field(time-1, 6))
+            average1 = averages[0][:-1]
+            average2 = averages[1][:-1]
+
+            skew_value1 = 3 * (average1 - growth_loc)
+            skew_value2 = 3 * (average2 - growth_loc)
+            seasonal_shift = 0.7 + 0.3 * np.cos(np.pi + 8.7266 * (10**-4)
+                                                * (time % 7200))
+
+            self.draw_field(magics[5, :-1], sampler, skew_value1,
+                            growth_loc * seasonal_shift, growth_scale, pool)
+            self.draw_field(magics[7, :-1], sampler, skew_value2, growth_loc,
+                            growth_scale, pool)
+
+    def gen_wind_and_water_field(self, magics, geometry, time, averages=None,
+                                 sampler=None, pool=None):
+        """
+        Determines the values of Serc and Romond Magic across every column of
+        the Map to the right of the left boundary.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The current time.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, they are found here.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        :param pool: A pool of threads to split the rows between. See
+                     draw_field.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        decay_loc = geometry.decay_loc_x[1:]
+        growth_loc = geometry.growth_loc_x[1:]
+        decay_scale = geometry.decay_scale_x[1:]
+        growth_scale = geometry.growth_scale_x[1:]
+
+        if time == 0:
+            self.draw_field(magics[9, :, 1:], sampler, 0, decay_loc,
+                            decay_scale, pool)
+            self.draw_field(magics[10, :, 1:], sampler, 0, growth_loc,
+                            growth_scale, pool)
+        else:
+            if averages is None:
+                averages = (self.find_LR_average_field(time-1, 9),
+                            self.find_LR_average_field(time-1, 10))
+            log_avg = averages[0][:, 1:]
+            exp_avg = averages[1][:, 1:]
+
+            decay_skew = 3 * (log_avg - decay_loc)
+            growth_skew = 3 * (exp_avg - growth_loc)
+
+            self.draw_field(magics[9, :, 1:], sampler, decay_skew, decay_loc,
+                            decay_scale, pool)
+            self.draw_field(magics[10, :, 1:], sampler, growth_skew,
+                            growth_loc, growth_scale, pool)
+
+    def gen_remainder_field(self, magics, geometry, time, averages=None,
+                            sampler=None, pool=None):
+        """
+        Determines the values of Dren and Vaelf Magic across every column of
+        the Map to the right of the left boundary.
+
+        :param magics: The Magic arrays at the current time step.
+        :param geometry: The RegionGeometry of the Map.
+        :param time: The current time.
+        :param averages: A pair of averaged fields from the previous time
+                         step. If not given, they are found here.
+        :param sampler: The sampler to draw from. If not given, the Map's own
+                        sampler is used.
+        :param pool: A pool of threads to split the rows between. See
+                     draw_field.
+        """
+
+        if sampler is None:
+            sampler = self.sampler
+
+        decay_loc = geometry.decay_loc_x[1:]
+        growth_loc = geometry.growth_loc_x[1:]
+        decay_scale = geometry.decay_scale_x[1:]
+        growth_scale = geometry.growth_scale_x[1:]
+
+        if time == 0:
+            self.draw_field(magics[8, :, 1:], sampler, 0, growth_loc,
+                            growth_scale, pool)
+            self.draw_field(magics[11, :, 1:], sampler, 0, decay_loc,
+                            decay_scale, pool)
+        else:
+            if averages is None:
+                averages = (self.find_LR_average_field(time-1, 8),
+                            self.find_LR_average_field(time-1, 11))
+            log_avg = averages[0][:, 1:]
+            exp_avg = averages[1][:, 1:]
+
+            decay_skew = 3 * (log_avg - decay_loc)
+            growth_skew = 3 * (exp_avg - growth_loc)
+
+            self.draw_field(magics[8, :, 1:], sampler, growth_skew,
+                            growth_loc, growth_scale, pool)
+            self.draw_field(magics[11, :, 1:], sampler, decay_skew,
+                            decay_loc, decay_scale, pool)
+
+    def neighbour_average(self, values, axis=-1):
+        """
+        Averages each value with its two neighbours along an axis. At either
+        end of the axis only the value and its one available neighbour are
+        averaged.
+
+        :param values: The array of values to average.
+        :param axis: The axis along which neighbours are found.
+        :return: An array of the averages, the same shape as the values.
+        """
+
+        values = np.moveaxis(np.asarray(values, dtype=float), axis, -1)
+        average = np.empty_like(values)
+        average[..., 1:-1] = (values[..., :-2] + values[..., 1:-1] +
+                              values[..., 2:]) / 3
+        average[..., 0] = (values[..., 0] + values[..., 1]) / 2
+        average[..., -1] = (values[..., -2] + values[..., -1]) / 2
+
+        return np.moveaxis(average, -1, axis)
+
+    def find_LR_average_field(self, time, magic):
+        """
+        Finds the average of the three values just east of every point on the
+        Map at once. Edge cases use the same two points as find_LR_average.
+        The left-most column has no points to its east and is left as NaN.
+
+        :param time: The time step to take the values from.
+        :param magic: The array of Magic being inspected.
+        :return: An array of the average values at every point.
+        """
+
+        values = self.magics[time, magic]
+        average = np.full(values.shape, np.nan)
+        average[:, 1:] = self.neighbour_average(values[:, :-1], axis=0)
+
+        return average
+
+    def find_TB_average_field(self, time, magic):
+        """
+        Finds the average of the three values just north of every point on the
+        Map at once. Edge cases use the same two points as find_TB_average.
+        The top row has no points to its north and is left as NaN.
+
+        :param time: The time step to take the values from.
+        :param magic: The array of Magic being inspected.
+        :return: An array of the average values at every point.
+        """
+
+        values = self.magics[time, magic]
+        average = np.full(values.shape, np.nan)
+        average[1:] = self.neighbour_average(values[:-1])
+
+        return average
+
+    def find_BT_average_field(self, time, magic):
+        """
+        Finds the average of the three values just south of every point on the
+        Map at once. Edge cases use the same two points as find_BT_average.
+        The bottom row has no points to its south and is left as NaN.
+
+        :param time: The time step to take the values from.
+        :param magic: The array of Magic being inspected.
+        :return: An array of the average values at every point.
+        """
+
+        values = self.magics[time, magic]
+        average = np.full(values.shape, np.nan)
+        average[:-1] = self.neighbour_average(values[1:])
+
+        return average
+
+    def find_average_fields(self, time):
+        """
+        Finds every averaged field which the Heat, Cold, Serc, Romond, Dren and
+        Vaelf generators need, so that each is only found once per time step.
+
+        :param time: The time step to take the values from.
+        :return: A dictionary of the pairs of averaged fields, keyed by the
+                 family of Magic which uses them.
+        """
+
+        return {'heat': (self.find_TB_average_field(time, 4),
+                         self.find_TB_average_field(time, 6)),
+                'cold': (self.find_BT_average_field(time, 4),
+                         self.find_BT_average_field(time, 6)),
+                'wind': (self.find_LR_average_field(time, 9),
+                         self.find_LR_average_field(time, 10)),
+                'remainder': (self.find_LR_average_field(time, 8),
+                              self.find_LR_average_field(time, 11))}
 
     def find_LR_average(self, height, time, magic, y, x):
         """
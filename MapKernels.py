@@ -0,0 +1,209 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains compiled kernels for the finite difference schemes of
+# the Map. They are compiled with numba when it is installed. Without numba
+# the Map falls back to its numpy engine, so numba is never required. Each
+# sweep covers a band of rows so that the map can be split into tiles.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def stencil_region(x, y, w):
+    """
+    Finds which stencil is used at a point, in the same way as
+    Map.calculate_next_time_step.
+
+    :return: The row of the stencil table; 0 for the roi, 1 for the inner
+             buffer, 2 and 3 for the outer horizontal and vertical edges, and
+             4 for the outer corners.
+    """
+
+    if (x == 1 or x == w) and (y == 1 or y == w):
+        return 4
+    elif x == 1 or x == w:
+        return 3
+    elif y == 1 or y == w:
+        return 2
+    elif x == 2 or y == 2 or x == w-1 or y == w-1:
+        return 1
+    return 0
+
+
+def roi_magic(previous, dif_field, c, x, y):
+    """
+    Finds the diffusion sum of the roi stencil at a point. The terms are
+    written out, in the same order as Map.roi_stencil, so that the compiler
+    can keep the whole stencil in registers. The coefficients c are the roi
+    row of the stencil table, so they share the type of the fields.
+    """
+
+    return (c[0] * dif_field[x-3, y] * previous[x-3, y] +
+            c[1] * dif_field[x-2, y] * previous[x-2, y] +
+            c[2] * dif_field[x-1, y] * previous[x-1, y] +
+            c[3] * dif_field[x, y] * previous[x, y] +
+            c[4] * dif_field[x+1, y] * previous[x+1, y] +
+            c[5] * dif_field[x+2, y] * previous[x+2, y] +
+            c[6] * dif_field[x+3, y] * previous[x+3, y] +
+            c[7] * dif_field[x, y-3] * previous[x, y-3] +
+            c[8] * dif_field[x, y-2] * previous[x, y-2] +
+            c[9] * dif_field[x, y-1] * previous[x, y-1] +
+            c[10] * dif_field[x, y+1] * previous[x, y+1] +
+            c[11] * dif_field[x, y+2] * previous[x, y+2] +
+            c[12] * dif_field[x, y+3] * previous[x, y+3])
+
+
+def roi_pressure(pressure, c, x, y):
+    """ Finds the pressure sum of the roi stencil at a point. """
+
+    return (c[0] * pressure[x-3, y] +
+            c[1] * pressure[x-2, y] +
+            c[2] * pressure[x-1, y] +
+            c[3] * pressure[x, y] +
+            c[4] * pressure[x+1, y] +
+            c[5] * pressure[x+2, y] +
+            c[6] * pressure[x+3, y] +
+            c[7] * pressure[x, y-3] +
+            c[8] * pressure[x, y-2] +
+            c[9] * pressure[x, y-1] +
+            c[10] * pressure[x, y+1] +
+            c[11] * pressure[x, y+2] +
+            c[12] * pressure[x, y+3])
+
+
+def table_magic(previous, dif_field, coefficients, offsets, length, x, y):
+    """
+    Finds the diffusion sum at a point of any stencil given as a row of the
+    stencil table.
+    """
+
+    px = x + offsets[0, 0]
+    py = y + offsets[0, 1]
+    magic = coefficients[0] * dif_field[px, py] * previous[px, py]
+    for k in range(1, length):
+        px = x + offsets[k, 0]
+        py = y + offsets[k, 1]
+        magic = magic + coefficients[k] * dif_field[px, py] * previous[px, py]
+
+    return magic
+
+
+def table_pressure(pressure, coefficients, offsets, length, x, y):
+    """
+    Finds the pressure sum at a point of any stencil given as a row of the
+    stencil table.
+    """
+
+    pres = coefficients[0] * pressure[x + offsets[0, 0], y + offsets[0, 1]]
+    for k in range(1, length):
+        pres = pres + coefficients[k] * pressure[x + offsets[k, 0],
+                                                 y + offsets[k, 1]]
+
+    return pres
+
+
+def fused_stencil_step(previous, current, dif_field, pressure, coefficients,
+                       offsets, lengths, map_width, beta, x_start, x_stop):
+    """
+    Finds the Magic field at the next time step in a single sweep over the
+    map. At each point the diffusion and pressure sums of the stencil for
+    that region are found together, in the same order as the point-wise
+    stencils, and written straight into the next time step.
+
+    :param previous: The Magic field at the previous time step.
+    :param current: The Magic field at the time step being calculated.
+    :param dif_field: The diffusion field associated with that Magic field.
+    :param pressure: The pressure field at the previous time step.
+    :param coefficients: A (5, n) array of the coefficients of each stencil,
+                         in the order roi, inner, outer horizontal, outer
+                         vertical and outer corner.
+    :param offsets: A (5, n, 2) array of the x-y offsets of each term.
+    :param lengths: The number of terms in each stencil.
+    :param map_width: The number of points across the region of interest.
+    :param beta: The weighting given to the Magical pressure, of the same
+                 type as the fields.
+    :param x_start: The first row of the map to sweep over.
+    :param x_stop: The row of the map to stop sweeping before.
+    """
+
+    w = map_width + 4
+
+    for x in range(x_start, x_stop):
+        for y in range(1, w+1):
+            s = stencil_region(x, y, w)
+            if s == 0:
+                magic = roi_magic(previous, dif_field, coefficients[0], x, y)
+                pres = roi_pressure(pressure, coefficients[0], x, y)
+            else:
+                magic = table_magic(previous, dif_field, coefficients[s],
+                                    offsets[s], lengths[s], x, y)
+                pres = table_pressure(pressure, coefficients[s], offsets[s],
+                                      lengths[s], x, y)
+
+            current[x, y] = previous[x, y] + magic + pres * beta
+
+
+def fused_pair_step(light_previous, light_current, dif_light, dark_previous,
+                    dark_current, dif_dark, pressure, coefficients, offsets,
+                    lengths, map_width, beta, x_start, x_stop):
+    """
+    Finds both the Light and Dark fields at the next time step in a single
+    sweep over the map. The pressure sum, which the two fields share, is
+    only found once at each point.
+
+    :param light_previous: The Light field at the previous time step.
+    :param light_current: The Light field at the time step being calculated.
+    :param dif_light: The diffusion field associated with Light.
+    :param dark_previous: The Dark field at the previous time step.
+    :param dark_current: The Dark field at the time step being calculated.
+    :param dif_dark: The diffusion field associated with Dark.
+    :param pressure: The pressure field at the previous time step.
+    :param coefficients: The coefficients of each stencil.
+    :param offsets: The x-y offsets of each term.
+    :param lengths: The number of terms in each stencil.
+    :param map_width: The number of points across the region of interest.
+    :param beta: The weighting given to the Magical pressure.
+    :param x_start: The first row of the map to sweep over.
+    :param x_stop: The row of the map to stop sweeping before.
+    """
+
+    w = map_width + 4
+
+    for x in range(x_start, x_stop):
+        for y in range(1, w+1):
+            s = stencil_region(x, y, w)
+            if s == 0:
+                pres = roi_pressure(pressure, coefficients[0], x, y)
+                light = roi_magic(light_previous, dif_light, coefficients[0],
+                                  x, y)
+                dark = roi_magic(dark_previous, dif_dark, coefficients[0], x,
+                                 y)
+            else:
+                pres = table_pressure(pressure, coefficients[s], offsets[s],
+                                      lengths[s], x, y)
+                light = table_magic(light_previous, dif_light,
+                                    coefficients[s], offsets[s], lengths[s],
+                                    x, y)
+                dark = table_magic(dark_previous, dif_dark, coefficients[s],
+                                   offsets[s], lengths[s], x, y)
+
+            light_current[x, y] = light_previous[x, y] + light + pres * beta
+            dark_current[x, y] = dark_previous[x, y] + dark + pres * beta
+
+
+if HAVE_NUMBA:
+    stencil_region = numba.njit(cache=True, inline='always')(stencil_region)
+    roi_magic = numba.njit(cache=True, inline='always')(roi_magic)
+    roi_pressure = numba.njit(cache=True, inline='always')(roi_pressure)
+    table_magic = numba.njit(cache=True)(table_magic)
+    table_pressure = numba.njit(cache=True)(table_pressure)
+    # The sweeps release the GIL so that tiles of the map can be swept by
+    # several threads at once.
+    fused_stencil_step = numba.njit(cache=True, nogil=True)(fused_stencil_step)
+    fused_pair_step = numba.njit(cache=True, nogil=True)(fused_pair_step)
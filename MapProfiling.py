@@ -0,0 +1,233 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains the instruments which can be attached to a run of the
+# RegionMap: a profiler which times each phase of every time step, with the
+# option of capturing a cProfile or tracemalloc record of the whole run, and
+# a progress reporter which says how far the run has got without printing
+# on every step.
+
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+
+class NullProfiler:
+    """
+    This class stands in for a Profiler when a run is not being profiled.
+    Its phases do nothing, so the cost of leaving the hooks in place is a
+    single method call per phase.
+    """
+
+    context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self.context
+
+
+class Profiler:
+    """
+    This class times the phases of each time step of a run. At the end of
+    every step a record of the time spent in each phase is passed to the
+    sink, if there is one, and added to the running totals.
+    """
+
+    def __init__(self, sink=None, capture=None):
+        """
+        :param sink: A function which is given the record of each time step
+                     as a dictionary, such as a MetricsLog.
+        :param capture: Either None, 'cprofile' to profile every function
+                        called during the run, or 'tracemalloc' to trace the
+                        memory allocated during the run.
+        """
+
+        if capture not in (None, 'cprofile', 'tracemalloc'):
+            raise ValueError("capture must be None, 'cprofile' or "
+                             "'tracemalloc', not {!r}".format(capture))
+
+        self.sink = sink
+        self.capture = capture
+        self.totals = {}
+        self.steps = 0
+        self.current = {}
+        self.step_start = None
+        self.profile = None
+        self.stats = None
+        self.snapshot = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times a phase of the current time step.
+
+        :param name: The name of the phase.
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = (self.current.get(name, 0) +
+                                  time.perf_counter() - start)
+
+    def start(self):
+        """ Starts capturing the profile or memory of the run. """
+
+        if self.capture == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.capture == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        """ Stops capturing and keeps what was captured. """
+
+        if self.capture == 'cprofile' and self.profile is not None:
+            self.profile.disable()
+            self.stats = pstats.Stats(self.profile, stream=io.StringIO())
+        elif self.capture == 'tracemalloc' and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def begin_step(self, time_step):
+        """
+        Starts timing a time step.
+
+        :param time_step: The time step which is about to be found.
+        """
+
+        self.current = {}
+        self.step_start = time.perf_counter()
+
+    def end_step(self, time_step, cells):
+        """
+        Finishes timing a time step and passes its record to the sink.
+
+        :param time_step: The time step which has been found.
+        :param cells: The number of values found during the step.
+        :return: The record of the time step.
+        """
+
+        total = time.perf_counter() - self.step_start
+        record = {'time': time_step, 'total': total, 'phases': self.current,
+                  'cells_per_second': cells / total if total else 0.0}
+        if self.capture == 'tracemalloc' and tracemalloc.is_tracing():
+            record['memory'], record['peak_memory'] = \
+                tracemalloc.get_traced_memory()
+
+        for name, elapsed in self.current.items():
+            self.totals[name] = self.totals.get(name, 0) + elapsed
+        self.totals['total'] = self.totals.get('total', 0) + total
+        self.steps += 1
+
+        if self.sink is not None:
+            self.sink(record)
+
+        return record
+
+    def summary(self):
+        """
+        :return: A list of (phase, total time, fraction of the run) for every
+                 phase, slowest first.
+        """
+
+        total = self.totals.get('total', 0) or 1
+        phases = [(name, elapsed, elapsed / total)
+                  for name, elapsed in self.totals.items() if name != 'total']
+
+        return sorted(phases, key=lambda phase: -phase[1])
+
+    def report(self, write=print, functions=10):
+        """
+        Writes out the summary, followed by the slowest functions or the
+        largest allocations if they were captured.
+
+        :param write: A function which is given each line of the report.
+        :param functions: The number of functions or allocations to list.
+        """
+
+        write('{} time steps in {:.3f} s'.format(self.steps,
+                                                 self.totals.get('total', 0)))
+        for name, elapsed, fraction in self.summary():
+            write('{:>14} {:10.4f} s {:6.1%}'.format(name, elapsed, fraction))
+
+        if self.stats is not None:
+            self.stats.stream = io.StringIO()
+            self.stats.sort_stats('cumulative').print_stats(functions)
+            for line in self.stats.stream.getvalue().splitlines():
+                write(line)
+        if self.snapshot is not None:
+            for statistic in self.snapshot.statistics('lineno')[:functions]:
+                write(str(statistic))
+
+
+class MetricsLog:
+    """
+    This class is a sink which writes the record of each time step to a file
+    as a line of JSON, so a long run can be watched as it goes.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: The name of the file to write, including its
+                         extension.
+        """
+
+        self.handle = open(filename, 'w')
+
+    def __call__(self, record):
+        self.handle.write(json.dumps(record) + '\n')
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ProgressReporter:
+    """
+    This class reports how far a run has got. It reports the first and last
+    time steps, and otherwise waits at least `interval` seconds between
+    reports, along with the number of steps found per second.
+    """
+
+    def __init__(self, interval=10.0, write=print):
+        """
+        :param interval: The least number of seconds between reports.
+        :param write: A function which is given each line of the report.
+        """
+
+        self.interval = interval
+        self.write = write
+        self.last = None
+        self.last_time = None
+
+    def __call__(self, time_step, stop):
+        """
+        Reports on a time step if it is time to.
+
+        :param time_step: The time step which has just been found.
+        :param stop: The time step the run stops before.
+        """
+
+        now = time.perf_counter()
+        if self.last is None:
+            self.write('Time = {}'.format(time_step))
+        elif now - self.last >= self.interval or time_step == stop - 1:
+            rate = (time_step - self.last_time) / (now - self.last)
+            self.write('Time = {} ({:.1f} steps/s)'.format(time_step, rate))
+        else:
+            return
+
+        self.last = now
+        self.last_time = time_step
@@ -0,0 +1,96 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains the sampler which draws the random values used to
+# generate Magic. It can draw a single value or a whole grid of values in one
+# call, and is seeded so that runs can be reproduced.
+
+import json
+import math
+
+import numpy as np
+
+
+class SkewNormSampler:
+    """
+    This class draws skew-normal random variates from a seeded numpy
+    Generator. The shape, location and scale can each be given as arrays, in
+    which case a value is drawn for every point of the grid in one call.
+    """
+
+    def __init__(self, seed=None):
+        """
+        :param seed: The seed for the random number generator. This can be an
+                     integer, a numpy SeedSequence or None for a random seed.
+        """
+
+        self.rng = np.random.default_rng(seed)
+
+    def get_state(self):
+        """
+        :return: The state of the random number generator as a JSON string,
+                 so that it can be stored in a checkpoint.
+        """
+
+        return json.dumps(self.rng.bit_generator.state)
+
+    def set_state(self, state):
+        """
+        Restores the random number generator to a state from get_state, so
+        the values drawn afterwards are the same as they would have been.
+
+        :param state: The JSON string from get_state.
+        """
+
+        self.rng.bit_generator.state = json.loads(state)
+
+    def rvs(self, a, loc=0, scale=1, size=None):
+        """
+        Draws skew-normal random variates. This matches the parameters of
+        scipy.stats.skewnorm.rvs, but avoids its per-call overhead.
+
+        :param a: The shape (skewness) parameter.
+        :param loc: The location parameter.
+        :param scale: The scale parameter.
+        :param size: The shape of the output. If not given, it is the
+                     broadcast shape of the parameters.
+        :return: A single value if all of the parameters are scalars and no
+                 size is given, otherwise an array of values.
+        """
+
+        if size is None and np.ndim(a) == np.ndim(loc) == np.ndim(scale) == 0:
+            u0, v = self.rng.standard_normal(2)
+            delta = a / math.sqrt(1 + a * a)
+            u1 = delta * u0 + math.sqrt(1 - delta * delta) * v
+            return loc + scale * (u1 if u0 >= 0 else -u1)
+
+        if size is None:
+            size = np.broadcast_shapes(np.shape(a), np.shape(loc),
+                                       np.shape(scale))
+        u0 = self.rng.standard_normal(size)
+        v = self.rng.standard_normal(size)
+
+        return self.transform(a, loc, scale, u0, v)
+
+    @staticmethod
+    def transform(a, loc, scale, u0, v):
+        """
+        Turns pairs of standard normal values into skew-normal values. A
+        skew-normal value is formed from the correlated normal u1, reflected
+        so that it takes the sign of u0.
+
+        :param a: The shape (skewness) parameter.
+        :param loc: The location parameter.
+        :param scale: The scale parameter.
+        :param u0: An array of standard normal values.
+        :param v: A second array of standard normal values.
+        :return: An array of skew-normal values.
+        """
+
+        a = np.asarray(a, dtype=float)
+        delta = a / np.sqrt(1 + a * a)
+        u1 = delta * u0 + np.sqrt(1 - delta * delta) * v
+        u1 = np.where(u0 >= 0, u1, -u1)
+
+        return loc + scale * u1
@@ -0,0 +1,159 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This file contains the writer which streams the Magic fields of a Map into
+# an HDF5 file one time step at a time, so that the whole history never has
+# to be held in memory and a run which stops part way still leaves a
+# readable file. It also contains the functions which save and load the
+# checkpoints a run can be restarted from.
+
+import os
+
+import numpy as np
+import h5py as h5
+
+
+class StreamWriter:
+    """
+    This class holds an HDF5 file with a resizable dataset for each field
+    being written. Every call to append adds one time step to the end of
+    each dataset and flushes the file to disk.
+    """
+
+    # The size in bytes which each chunk of a dataset is kept below.
+    chunk_bytes = 1 << 20
+
+    def __init__(self, filename, fields, compression=None, resume_at=None):
+        """
+        :param filename: The name of the file to write, including its
+                         extension.
+        :param fields: A dictionary of the shape and dtype of a single time
+                       step of each field, keyed by the name of its dataset.
+        :param compression: The HDF5 compression filter to use, such as
+                            'gzip' or 'lzf', or None for no compression.
+        :param resume_at: If given, carry on writing an existing file from
+                          this time step, discarding any later time steps
+                          written after the checkpoint being restarted from.
+        """
+
+        if resume_at is not None:
+            self.handle = h5.File(filename, 'r+')
+            self.length = resume_at
+            for name in fields:
+                self.handle[name].resize(resume_at, axis=0)
+            self.handle.flush()
+            return
+
+        self.handle = h5.File(filename, 'w')
+        self.length = 0
+        for name, (frame_shape, dtype) in fields.items():
+            frame_shape = tuple(frame_shape)
+            self.handle.create_dataset(
+                name, shape=(0,) + frame_shape, maxshape=(None,) + frame_shape,
+                dtype=dtype, compression=compression,
+                chunks=self.chunk_shape(frame_shape, np.dtype(dtype).itemsize))
+
+    def chunk_shape(self, frame_shape, itemsize):
+        """
+        Finds the shape of the chunks of a dataset. Each chunk holds part of
+        a single time step, so appending a time step only ever writes whole
+        chunks. A time step is split along its leading axes until each chunk
+        is below chunk_bytes.
+
+        :param frame_shape: The shape of a single time step.
+        :param itemsize: The number of bytes in each value.
+        :return: The shape of a chunk, including the time axis.
+        """
+
+        chunk = list(frame_shape)
+        for axis in range(len(chunk)):
+            while (chunk[axis] > 1 and
+                   np.prod(chunk) * itemsize > self.chunk_bytes):
+                chunk[axis] = (chunk[axis] + 1) // 2
+
+        return (1,) + tuple(chunk)
+
+    def add_static(self, name, data):
+        """
+        Stores a dataset which does not change over time.
+
+        :param name: The name of the dataset.
+        :param data: The values to store.
+        """
+
+        self.handle.create_dataset(name, data=data)
+        self.handle.flush()
+
+    def append(self, **frames):
+        """
+        Adds one time step to the end of each field and flushes the file, so
+        the time step is safely on disk once this returns.
+
+        :param frames: The values of each field at the new time step, keyed
+                       by the name of its dataset.
+        """
+
+        for name, frame in frames.items():
+            dataset = self.handle[name]
+            dataset.resize(self.length + 1, axis=0)
+            dataset[self.length] = frame
+        self.length += 1
+        self.handle.flush()
+
+    def close(self):
+        """ Closes the file if it is still open. """
+
+        if self.handle.id.valid:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save_checkpoint(filename, fields, attributes):
+    """
+    Saves the state needed to carry on a run. The checkpoint is first written
+    to a temporary file which then replaces the old checkpoint, so a run
+    which is killed part way through saving still leaves the previous
+    checkpoint intact.
+
+    :param filename: The name of the checkpoint file, including its
+                     extension.
+    :param fields: A dictionary of the arrays to save, keyed by name.
+    :param attributes: A dictionary of the scalar and string values to save,
+                       keyed by name.
+    """
+
+    temporary = filename + '.tmp'
+    with h5.File(temporary, 'w') as h5handle:
+        for name, data in fields.items():
+            h5handle.create_dataset(name, data=data)
+        for name, value in attributes.items():
+            h5handle.attrs[name] = value
+    os.replace(temporary, filename)
+
+
+def load_checkpoint(filename):
+    """
+    Loads a checkpoint saved by save_checkpoint.
+
+    :param filename: The name of the checkpoint file, including its
+                     extension.
+    :return: The dictionaries of arrays and of attributes which were saved.
+    """
+
+    with h5.File(filename, 'r') as h5handle:
+        fields = {name: h5handle[name][:] for name in h5handle}
+        attributes = {}
+        for name, value in h5handle.attrs.items():
+            if isinstance(value, bytes):
+                value = value.decode()
+            elif isinstance(value, np.generic):
+                value = value.item()
+            attributes[name] = value
+
+    return fields, attributes
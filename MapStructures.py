@@ -1,13 +1,233 @@
 # Author: Jack Adams
 # Date Started: 18/05/17
-# Last Updated: 18/06/1
+# Last Updated: 26/10/16
 
 # This file contains the definitions of the map and point structures. It also
 # contains all of the methods which act on those structures.
 
+import numbers
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from scipy.stats import skewnorm
 import h5py as h5
+import scipy.sparse
+import scipy.sparse.linalg
+
+import MapKernels
+from MapBoundaries import StochasticBoundary, PeriodicBoundary
+from MapSampling import SkewNormSampler
+from MapStorage import StreamWriter, save_checkpoint, load_checkpoint
+
+
+class TimeStore:
+    """
+    This class holds a field (such as a Magic or pressure field) over time in
+    a preallocated array, so that moving on to the next time step does not
+    copy the whole history. It is indexed like a numpy array whose first axis
+    is time.
+
+    In 'chunked' mode every time step is kept and the array is grown in
+    chunks which double in size whenever it fills up. In 'rolling' mode only
+    the last `capacity` time steps are kept, so the memory used never grows.
+    """
+
+    # The number of time steps a chunked store allocates space for at first.
+    chunk = 64
+
+    def __init__(self, frame_shape, capacity=None, mode='chunked',
+                 dtype=float):
+        """
+        :param frame_shape: The shape of the field at a single time step.
+        :param capacity: The number of time steps to allocate space for. For a
+                         rolling store this is the number of steps kept.
+        :param mode: Either 'chunked' or 'rolling'.
+        :param dtype: The data type the field is stored as.
+        """
+
+        if mode not in ('chunked', 'rolling'):
+            raise ValueError("mode must be 'chunked' or 'rolling', not "
+                             "{!r}".format(mode))
+        if capacity is None:
+            capacity = 2 if mode == 'rolling' else self.chunk
+        if capacity < 1:
+            raise ValueError('capacity must be at least one time step')
+
+        self.frame_shape = tuple(frame_shape)
+        self.mode = mode
+        self.capacity = capacity
+        self.data = np.zeros((capacity,) + self.frame_shape, dtype=dtype)
+        self.length = 0
+
+        # The earliest time step held by a chunked store, which is only
+        # after time 0 for a store resumed part way through a history.
+        self.offset = 0
+
+    @classmethod
+    def from_array(cls, array, capacity=None, mode='chunked'):
+        """
+        Creates a store holding a copy of an existing history array.
+
+        :param array: An array whose first axis is time.
+        :param capacity: The number of time steps to allocate space for. If
+                         not given, a chunked store is made large enough for
+                         the whole array.
+        :param mode: Either 'chunked' or 'rolling'.
+        :return: The new store.
+        """
+
+        array = np.asarray(array)
+        if capacity is None and mode == 'chunked':
+            capacity = max(array.shape[0], cls.chunk)
+        store = cls(array.shape[1:], capacity, mode, array.dtype)
+        for frame in array:
+            store.append(frame)
+
+        return store
+
+    @classmethod
+    def resume(cls, frames, length, capacity=None, mode='chunked'):
+        """
+        Creates a store which carries on from the last few time steps of an
+        earlier history, such as those kept in a checkpoint. The earlier
+        time steps are not known, so they are not held and cannot be
+        indexed.
+
+        :param frames: An array of the last time steps of the history.
+        :param length: The number of time steps in the whole history.
+        :param capacity: The number of time steps to allocate space for.
+        :param mode: Either 'chunked' or 'rolling'.
+        :return: The new store.
+        """
+
+        frames = np.asarray(frames)
+        if mode == 'chunked':
+            capacity = max(capacity or cls.chunk, frames.shape[0])
+        store = cls(frames.shape[1:], capacity, mode, frames.dtype)
+        store.length = length - frames.shape[0]
+        if mode == 'chunked':
+            store.offset = store.length
+        for frame in frames:
+            store.append(frame)
+
+        return store
+
+    @property
+    def shape(self):
+        """ The shape of the full history, including any discarded steps. """
+
+        return (self.length,) + self.frame_shape
+
+    @property
+    def ndim(self):
+        return len(self.frame_shape) + 1
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def first_time(self):
+        """ The earliest time step which is still held in the store. """
+
+        if self.mode == 'rolling':
+            return max(self.length - self.capacity, 0)
+        return self.offset
+
+    def __len__(self):
+        return self.length
+
+    def append(self, frame=None):
+        """
+        Adds a new time step to the end of the store. Space is reused or
+        allocated in chunks so the existing history is not copied every time.
+
+        :param frame: The values to place in the new time step. If not given,
+                      the new time step is filled with zeros.
+        """
+
+        if self.mode == 'rolling':
+            slot = self.length % self.capacity
+        else:
+            slot = self.length - self.offset
+            if slot == self.data.shape[0]:
+                grown = np.zeros((2 * slot,) + self.frame_shape,
+                                 dtype=self.data.dtype)
+                grown[:slot] = self.data
+                self.data = grown
+
+        if frame is None:
+            self.data[slot] = 0
+        else:
+            self.data[slot] = frame
+        self.length += 1
+
+    def slot(self, time):
+        """
+        Finds where in the preallocated array a time step is kept.
+
+        :param time: The time step, which may be negative to count back from
+                     the latest time step.
+        :return: The index into the first axis of the preallocated array.
+        """
+
+        if time < 0:
+            time += self.length
+        if not 0 <= time < self.length:
+            raise IndexError('time step {} is outside of the {} steps held'
+                             .format(time, self.length))
+        if time < self.first_time:
+            raise IndexError('time step {} is no longer held in the store'
+                             .format(time))
+
+        if self.mode == 'rolling':
+            return time % self.capacity
+        return time - self.offset
+
+    def index(self, key):
+        """
+        Converts an index into the history into an index into the
+        preallocated array.
+
+        :param key: An index into the history whose first entry is time.
+        :return: The equivalent index into the preallocated array.
+        """
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        time, rest = key[0], key[1:]
+
+        if isinstance(time, numbers.Integral):
+            return (self.slot(int(time)),) + rest
+        if isinstance(time, slice):
+            times = range(*time.indices(self.length))
+            if self.mode == 'chunked':
+                if not times:
+                    return (slice(0, 0),) + rest
+                if min(times[0], times[-1]) < self.offset:
+                    raise IndexError('time step {} is no longer held in the '
+                                     'store'.format(min(times[0], times[-1])))
+                # A slice counting down to the first time step held has to
+                # stop at None, since a stop of -1 would count from the end.
+                start = times.start - self.offset
+                stop = times.stop - self.offset
+                return (slice(start, stop if stop >= 0 else None,
+                              times.step),) + rest
+            return ([self.slot(t) for t in times],) + rest
+
+        raise TypeError('time steps must be indexed by an integer or a slice')
+
+    def __getitem__(self, key):
+        return self.data[self.index(key)]
+
+    def __setitem__(self, key, value):
+        self.data[self.index(key)] = value
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[self.first_time:]
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
 
 
 class Map:
@@ -23,7 +243,66 @@ class Map:
     DifDark = None
     LDPressure = None
 
-    def prepare_map_arrays(self, map_width):
+    # The file which a lazily loaded map is read from.
+    handle = None
+
+    # How the history of each Magic field is kept over time. See TimeStore.
+    history = 'chunked'
+    capacity = None
+
+    # The floating point type every field of the map is stored as.
+    dtype = np.dtype(float)
+
+    # The pool of threads which advances tiles of the map in parallel.
+    pool = None
+    pool_size = 0
+
+    # The boundary conditions placed around Light and Dark. None draws each
+    # edge at random around its previous values. See MapBoundaries.
+    light_boundary = None
+    dark_boundary = None
+    stochastic_boundary = StochasticBoundary()
+
+    # The assembled stencil operators of the sparse backend. See
+    # sparse_operators.
+    sparse_cache = None
+
+    # The factorised system of the implicit integrator, along with what it was
+    # built from so that it is only rebuilt when one of those changes.
+    implicit_cache = None
+
+    # The weighting given to the Magical pressure in every stencil.
+    beta = 0.02
+
+    # Each stencil is stored as a tuple of (coefficient, x-offset, y-offset)
+    # terms. The terms are listed in the same order as they are summed in the
+    # point-wise stencil methods so that the whole-array engine gives
+    # identical results.
+    ROI_STENCIL = ((1/45, -3, 0), (-3/10, -2, 0), (3, -1, 0), (-98/9, 0, 0),
+                   (3, 1, 0), (-3/10, 2, 0), (1/45, 3, 0), (1/45, 0, -3),
+                   (-3/10, 0, -2), (3, 0, -1), (3, 0, 1), (-3/10, 0, 2),
+                   (1/45, 0, 3))
+    INNER_STENCIL = ((-1/6, -2, 0), (8/3, -1, 0), (-10, 0, 0), (8/3, 1, 0),
+                     (-1/6, 2, 0), (-1/6, 0, -2), (8/3, 0, -1), (8/3, 0, 1),
+                     (-1/6, 0, 2))
+    OUTER_HORZ_STENCIL = ((-1/6, -2, 0), (8/3, -1, 0), (-9, 0, 0),
+                          (8/3, 1, 0), (-1/6, 2, 0), (2, 0, -1), (2, 0, 1))
+    OUTER_VERT_STENCIL = ((2, -1, 0), (-9, 0, 0), (2, 1, 0), (-1/6, 0, -2),
+                          (8/3, 0, -1), (8/3, 0, 1), (-1/6, 0, 2))
+    OUTER_CORNER_STENCIL = ((2, -1, 0), (2, 0, -1), (-8, 0, 0), (2, 1, 0),
+                            (2, 0, 1))
+
+    def __init__(self, seed=None):
+        """
+        :param seed: The seed for the random numbers used in the boundary
+                     conditions and forcing functions, so that a run can be
+                     reproduced.
+        """
+
+        self.sampler = SkewNormSampler(seed)
+
+    def prepare_map_arrays(self, map_width, history='chunked', capacity=None,
+                           dtype=float):
         """
         This method will generate the set of points corresponding to locations
         on the map. The map will have a buffer of three additional points
@@ -32,18 +311,38 @@ class Map:
 
         :param map_width: An integer corresponding to the desired number of
                           points across the map.
+        :param history: How the Magic fields are kept over time; 'chunked'
+                        keeps every time step, 'rolling' keeps only the last
+                        `capacity` steps.
+        :param capacity: The number of time steps to allocate space for.
+                         Defaults to the two steps the stencils need for a
+                         rolling history.
+        :param dtype: Either np.float64 or np.float32. Single precision
+                      halves the memory used and the data the stencils move.
         """
 
-        self.Light = np.zeros([map_width + 6, map_width + 6])
-        self.Dark = np.zeros([map_width + 6, map_width + 6])
-        self.DifLight = np.zeros([map_width + 6, map_width + 6])
-        self.DifDark = np.zeros([map_width + 6, map_width + 6])
-        self.LDPressure = np.zeros([map_width + 6, map_width + 6])
+        dtype = np.dtype(dtype)
+        if not np.issubdtype(dtype, np.floating):
+            raise ValueError('the map must be stored as floating point '
+                             'values, not {}'.format(dtype))
+
+        self.history = history
+        self.capacity = capacity
+        self.dtype = dtype
+
+        self.Light = np.zeros([map_width + 6, map_width + 6], dtype=dtype)
+        self.Dark = np.zeros([map_width + 6, map_width + 6], dtype=dtype)
+        self.DifLight = np.zeros([map_width + 6, map_width + 6], dtype=dtype)
+        self.DifDark = np.zeros([map_width + 6, map_width + 6], dtype=dtype)
+        self.LDPressure = np.zeros([map_width + 6, map_width + 6],
+                                   dtype=dtype)
 
     def initialise_values(self, magic_value=-1, dif_value=-1):
         """
         Seed the created arrays with random values unless a specific starting
-        value is provided
+        value is provided. Each value can be given as a single number, an
+        array the size of the map, a function of the (i, j) indices of a
+        point, or the name of a .npy or text file holding such an array.
 
         :param magic_value: A specific starting value given to start the arrays
                             at.
@@ -51,57 +350,89 @@ class Map:
                           diffusion value of each array at.
         """
 
-        if magic_value == -1:
-            for i in range(self.Light.shape[0]):
-                for j in range(self.Light.shape[1]):
-                    self.Light[i, j] = 100
-                    self.Dark[i, j] = 100
-                    self.LDPressure[i, j] = self.Light[i, j] + self.Dark[i, j]
-
-        elif magic_value != -1:
-            for i in range(self.Light.shape[0]):
-                for j in range(self.Light.shape[1]):
-                    self.Light[i, j] = magic_value
-                    self.Dark[i, j] = magic_value
-                    self.LDPressure[i, j] = self.Light[i, j] + self.Dark[i, j]
-
-        if dif_value == -1:
-            for i in range(self.Light.shape[0]):
-                for j in range(self.Light.shape[1]):
-                    self.DifLight[i, j] = 1
-                    self.DifDark[i, j] = 1
-
-        elif dif_value != -1:
-            for i in range(self.Light.shape[0]):
-                for j in range(self.Light.shape[1]):
-                    self.DifLight[i, j] = dif_value
-                    self.DifDark[i, j] = dif_value
+        magic = self.field_values(magic_value, 100)
+        dif = self.field_values(dif_value, 1)
+
+        self.Light[:, :] = magic
+        self.Dark[:, :] = magic
+        self.LDPressure[:, :] = self.Light + self.Dark
+        self.DifLight[:, :] = dif
+        self.DifDark[:, :] = dif
+
+    def field_values(self, value, default):
+        """
+        Turns one of the forms of starting value accepted by
+        initialise_values into an array the size of the map.
+
+        :param value: A number, an array, a function of (i, j), a filename,
+                      or -1 for the default.
+        :param default: The number used when the value is -1.
+        :return: An array of the starting values across the map.
+        """
+
+        shape = self.Light.shape
+
+        if isinstance(value, (str, os.PathLike)):
+            if os.fspath(value).endswith('.npy'):
+                value = np.load(value)
+            else:
+                value = np.loadtxt(value, ndmin=2)
+        elif callable(value):
+            # The function is first given whole arrays of indices, which works
+            # for any function built from numpy operations. Functions which
+            # can only handle a single point are then called at every point.
+            try:
+                values = np.fromfunction(value, shape, dtype=int)
+                if np.shape(values) != shape:
+                    raise ValueError
+                value = values
+            except (ValueError, TypeError):
+                value = np.vectorize(value, otypes=[float])(
+                    *np.indices(shape))
+        elif np.ndim(value) == 0 and value == -1:
+            value = default
+
+        value = np.asarray(value, dtype=self.dtype)
+        if value.ndim != 0 and value.shape != shape:
+            raise ValueError('starting values of shape {} do not fit the map '
+                             'of shape {}'.format(value.shape, shape))
+
+        return value
 
     def create_next_time_step(self):
-        """ Increases the third dimension of each Magic array by one. """
-
-        sizes = self.Light.shape
-
-        if len(sizes) == 2:
-            empty_array = np.zeros([1, sizes[0], sizes[1]])
-            self.Light = np.array([self.Light])
-            self.Light = np.append(self.Light, empty_array, axis=0)
-            self.Dark = np.array([self.Dark])
-            self.Dark = np.append(self.Dark, empty_array, axis=0)
-            self.LDPressure = np.array([self.LDPressure])
-            self.LDPressure = np.append(self.LDPressure, empty_array, axis=0)
-
-        elif len(sizes) == 3:
-            self.Light = np.append(self.Light, np.zeros([1, sizes[1], sizes[2]]),
-                                   axis=0)
-            self.Dark = np.append(self.Dark, np.zeros([1, sizes[1], sizes[2]]),
-                                  axis=0)
-            self.LDPressure = np.append(self.LDPressure, np.zeros([1, sizes[1],
-                                                                   sizes[2]]),
-                                        axis=0)
+        """
+        Increases the time dimension of each Magic array by one. The first
+        call turns the arrays into time stores, after which a time step is
+        added without copying the history.
+        """
+
+        if isinstance(self.Light, np.ndarray):
+            self.Light = self.as_time_store(self.Light)
+            self.Dark = self.as_time_store(self.Dark)
+            self.LDPressure = self.as_time_store(self.LDPressure)
+
+        self.Light.append()
+        self.Dark.append()
+        self.LDPressure.append()
+
+    def as_time_store(self, field):
+        """
+        Wraps a field in a time store which follows the history settings of
+        the map.
+
+        :param field: Either a single time slice or an array whose first axis
+                      is time.
+        :return: A time store holding the field.
+        """
+
+        if field.ndim == 2:
+            field = field[np.newaxis]
+
+        return TimeStore.from_array(field, self.capacity, self.history)
 
     def calculate_next_time_step(self, magic_field, dif_field, pres_field,
-                                 tstep, map_width):
+                                 tstep, map_width, vectorised=True,
+                                 backend='numpy', workers=1):
         """
         This method is called to do most of the work. This method looks at the
         previous time step, looping through them. It calls various finite
@@ -111,8 +442,23 @@ class Map:
 
         :param tstep: The time step for which these values will be calculated.
         :param map_width: The width of the generated map.
+        :param vectorised: If True, apply each stencil to whole regions of the
+                           map at once. Otherwise fall back to calling the
+                           point-wise stencil methods for every point.
+        :param backend: Either 'numpy', 'numba' or 'sparse'. The numba backend
+                        runs a compiled kernel which covers the map in one
+                        sweep. If numba is not installed the numpy engine is
+                        used. The sparse backend multiplies by the cached
+                        operators of sparse_operators.
+        :param workers: The number of threads which advance tiles of the map
+                        in parallel. None uses every core.
         """
 
+        if vectorised:
+            self.advance_fields([(magic_field, dif_field)], pres_field, tstep,
+                                map_width, backend, workers)
+            return
+
         w = map_width + 4
 
         for i in range(1, w+1):
@@ -134,6 +480,770 @@ class Map:
                     self.roi_stencil(magic_field, dif_field, pres_field,
                                      tstep, i, j)
 
+    def stencil_regions(self, map_width):
+        """
+        Splits the map into the rectangular regions which share a stencil. The
+        regions match the choice of stencil made point by point in
+        calculate_next_time_step.
+
+        :param map_width: The number of points across the region of interest.
+        :return: A list of (stencil, rows, columns) tuples where the rows and
+                 columns are slices into the map arrays.
+        """
+
+        w = map_width + 4
+
+        return [(self.ROI_STENCIL, slice(3, w-1), slice(3, w-1)),
+                (self.INNER_STENCIL, slice(2, 3), slice(2, w)),
+                (self.INNER_STENCIL, slice(w-1, w), slice(2, w)),
+                (self.INNER_STENCIL, slice(3, w-1), slice(2, 3)),
+                (self.INNER_STENCIL, slice(3, w-1), slice(w-1, w)),
+                (self.OUTER_VERT_STENCIL, slice(1, 2), slice(2, w)),
+                (self.OUTER_VERT_STENCIL, slice(w, w+1), slice(2, w)),
+                (self.OUTER_HORZ_STENCIL, slice(2, w), slice(1, 2)),
+                (self.OUTER_HORZ_STENCIL, slice(2, w), slice(w, w+1)),
+                (self.OUTER_CORNER_STENCIL, slice(1, 2), slice(1, 2)),
+                (self.OUTER_CORNER_STENCIL, slice(1, 2), slice(w, w+1)),
+                (self.OUTER_CORNER_STENCIL, slice(w, w+1), slice(1, 2)),
+                (self.OUTER_CORNER_STENCIL, slice(w, w+1), slice(w, w+1))]
+
+    def apply_stencil(self, stencil, field, weights, rows, cols):
+        """
+        Applies a stencil to a whole rectangular region of a field at once by
+        summing shifted slices of that field.
+
+        :param stencil: A tuple of (coefficient, x-offset, y-offset) terms.
+        :param field: A single time slice of a Magic or pressure field.
+        :param weights: The diffusion field which weights each term, or None
+                        if the terms are unweighted.
+        :param rows: The slice of rows the stencil is applied over.
+        :param cols: The slice of columns the stencil is applied over.
+        :return: An array holding the stencil sum at each point of the region.
+        """
+
+        total = None
+        for coefficient, dx, dy in stencil:
+            r = slice(rows.start + dx, rows.stop + dx)
+            c = slice(cols.start + dy, cols.stop + dy)
+            if weights is None:
+                term = coefficient * field[r, c]
+            else:
+                term = coefficient * weights[r, c] * field[r, c]
+            total = term if total is None else total + term
+
+        return total
+
+    def vectorised_fields_step(self, fields, pres_field, tstep, map_width,
+                               tile=None):
+        """
+        Finds several Magic fields which share a pressure field at the next
+        time step. The pressure sum of each region is only found once and is
+        then used for every field.
+
+        :param fields: A list of (Magic field, diffusion field) pairs.
+        :param pres_field: The array which corresponds to the sum of Magics
+                           at a point.
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        :param tile: The (start, stop) rows of the map to work on. If not
+                     given, the whole map is worked on.
+        """
+
+        pressure_field = pres_field[tstep-1]
+        slices = [(magic_field[tstep-1], magic_field[tstep], dif_field)
+                  for magic_field, dif_field in fields]
+
+        for stencil, rows, cols in self.stencil_regions(map_width):
+            if tile is not None:
+                rows = slice(max(rows.start, tile[0]), min(rows.stop, tile[1]))
+                if rows.start >= rows.stop:
+                    continue
+            pressure = self.apply_stencil(stencil, pressure_field, None, rows,
+                                          cols) * self.beta
+            for previous, current, dif_field in slices:
+                magic = self.apply_stencil(stencil, previous, dif_field, rows,
+                                           cols)
+                current[rows, cols] = previous[rows, cols] + magic + pressure
+
+    def stencil_table(self, dtype=float):
+        """
+        Packs the stencils into arrays which the compiled kernels can read.
+
+        :param dtype: The floating point type of the coefficients, which
+                      should match the fields they are applied to.
+        :return: The coefficients, the x-y offsets and the number of terms of
+                 the roi, inner, outer horizontal, outer vertical and outer
+                 corner stencils, in that order.
+        """
+
+        stencils = (self.ROI_STENCIL, self.INNER_STENCIL,
+                    self.OUTER_HORZ_STENCIL, self.OUTER_VERT_STENCIL,
+                    self.OUTER_CORNER_STENCIL)
+        terms = max(len(stencil) for stencil in stencils)
+
+        coefficients = np.zeros([len(stencils), terms], dtype=dtype)
+        offsets = np.zeros([len(stencils), terms, 2], dtype=np.int64)
+        lengths = np.zeros(len(stencils), dtype=np.int64)
+        for s, stencil in enumerate(stencils):
+            lengths[s] = len(stencil)
+            for k, (coefficient, dx, dy) in enumerate(stencil):
+                coefficients[s, k] = coefficient
+                offsets[s, k] = dx, dy
+
+        return coefficients, offsets, lengths
+
+    def tiles(self, map_width, count):
+        """
+        Splits the rows of the map which are calculated into bands, or tiles.
+        Every tile reads a halo of up to three rows either side of it from
+        the previous time step. Since the previous time step is not changed
+        while a step is calculated, the tiles can share it and the halos are
+        up to date at the start of every step.
+
+        :param map_width: The number of points across the region of interest.
+        :param count: The number of tiles wanted.
+        :return: A list of the (start, stop) rows of each tile.
+        """
+
+        bounds = np.linspace(1, map_width + 5, count + 1).round().astype(int)
+
+        return [(int(start), int(stop)) for start, stop in
+                zip(bounds[:-1], bounds[1:]) if start < stop]
+
+    def thread_pool(self, workers):
+        """
+        Finds a pool of threads of the given size, only starting a new pool
+        if the size has changed.
+
+        :param workers: The number of threads in the pool.
+        :return: The pool of threads.
+        """
+
+        if self.pool is None or self.pool_size != workers:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+            self.pool_size = workers
+
+        return self.pool
+
+    def advance_fields(self, fields, pres_field, tstep, map_width,
+                       backend='numpy', workers=1):
+        """
+        Finds one or more Magic fields which share a pressure field at the
+        next time step. With more than one worker the map is split into
+        tiles which are advanced in parallel by a pool of threads; the numpy
+        and numba kernels both release the GIL while they run.
+
+        :param fields: A list of (Magic field, diffusion field) pairs.
+        :param pres_field: The array which corresponds to the sum of Magics
+                           at a point.
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        :param backend: Either 'numpy', 'numba' or 'sparse'. The sparse
+                        backend always works on the whole map at once.
+        :param workers: The number of threads to use. None uses every core.
+        """
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if backend == 'sparse':
+            self.sparse_fields_step(fields, pres_field, tstep, map_width)
+            return
+
+        if backend == 'numba' and MapKernels.HAVE_NUMBA and len(fields) <= 2:
+            pressure = pres_field[tstep-1]
+            coefficients, offsets, lengths = self.stencil_table(pressure.dtype)
+            beta = pressure.dtype.type(self.beta)
+            if len(fields) == 1:
+                (magic_field, dif_field), = fields
+                arguments = (magic_field[tstep-1], magic_field[tstep],
+                             dif_field)
+                kernel = MapKernels.fused_stencil_step
+            else:
+                (light, dif_light), (dark, dif_dark) = fields
+                arguments = (light[tstep-1], light[tstep], dif_light,
+                             dark[tstep-1], dark[tstep], dif_dark)
+                kernel = MapKernels.fused_pair_step
+
+            def advance(tile):
+                kernel(*arguments, pressure, coefficients, offsets, lengths,
+                       map_width, beta, tile[0], tile[1])
+        else:
+            def advance(tile):
+                self.vectorised_fields_step(fields, pres_field, tstep,
+                                            map_width, tile)
+
+        tiles = self.tiles(map_width, workers)
+        if len(tiles) == 1:
+            advance(tiles[0])
+        else:
+            list(self.thread_pool(workers).map(advance, tiles))
+
+    def step(self, tstep, map_width, vectorised=True, backend='numpy',
+             workers=1, integrator='explicit', dt=1.0, theta=0.5):
+        """
+        Advances the whole map by one time step. Light and Dark are found
+        together, sharing the pressure sums, before their boundary conditions,
+        the forcing functions and the new pressure are put in place. This
+        gives the same result as calling each of those methods in turn.
+
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        :param vectorised: If False, fall back to the point-wise stencils.
+        :param backend: Either 'numpy', 'numba' or 'sparse', as for
+                        calculate_next_time_step.
+        :param workers: The number of threads which advance tiles of the map
+                        in parallel. None uses every core.
+        :param integrator: Either 'explicit' for the forward Euler stencils,
+                           'implicit' for the theta method of
+                           implicit_fields_step, which can take steps longer
+                           than one explicit step, or 'spectral' for the FFT
+                           solver of spectral_fields_step. 'auto' uses the
+                           spectral solver when spectral_available and the
+                           explicit stencils otherwise. The spectral solver
+                           is only used when asked for, since its results
+                           differ from the stencils; see
+                           spectral_fields_step.
+        :param dt: The length of the step, as a number of explicit steps. The
+                   spectral solver takes a whole number of explicit steps at
+                   once, and the explicit stencils only take steps of 1.
+        :param theta: The weighting of the implicit integrator; 0.5 is
+                      Crank-Nicolson and 1 is backward Euler.
+        """
+
+        if integrator == 'auto':
+            integrator = ('spectral' if self.spectral_available()
+                          else 'explicit')
+
+        if integrator == 'implicit':
+            self.implicit_fields_step(tstep, map_width, dt, theta)
+        elif integrator == 'spectral':
+            if dt != int(dt) or dt < 1:
+                raise ValueError('the spectral solver can only take a whole '
+                                 'number of steps')
+            self.spectral_fields_step(tstep, map_width, int(dt))
+        elif integrator != 'explicit':
+            raise ValueError("integrator must be 'explicit', 'implicit', "
+                             "'spectral' or 'auto', not {!r}"
+                             .format(integrator))
+        elif dt != 1:
+            raise ValueError('the explicit integrator can only take steps of '
+                             'length 1')
+        elif not vectorised:
+            self.calculate_next_time_step(self.Light, self.DifLight,
+                                          self.LDPressure, tstep, map_width,
+                                          vectorised=False)
+            self.calculate_next_time_step(self.Dark, self.DifDark,
+                                          self.LDPressure, tstep, map_width,
+                                          vectorised=False)
+        else:
+            self.advance_fields([(self.Light, self.DifLight),
+                                 (self.Dark, self.DifDark)], self.LDPressure,
+                                tstep, map_width, backend, workers)
+
+        self.generate_BCs(self.Light, tstep, map_width, self.light_boundary)
+        self.generate_BCs(self.Dark, tstep, map_width, self.dark_boundary)
+        self.LD_forcing_functions(self.Light, self.Dark, tstep, map_width, dt)
+        self.update_pressure(self.Light, self.Dark, self.LDPressure, tstep,
+                             map_width)
+
+    def stencil_operator(self, map_width, dtype=float):
+        """
+        Assembles the stencils into a sparse matrix which acts on a whole
+        time slice of the map, flattened. The row of each point of the
+        region of interest and its buffer holds the coefficients of the
+        stencil used at that point; the rows of the outer edge are empty.
+        The matrix only depends on the size of the map and the type of its
+        fields, so it is kept and reused until either changes.
+
+        :param map_width: The number of points across the region of interest.
+        :param dtype: The floating point type of the coefficients, which
+                      should match the fields they are applied to.
+        :return: The stencil matrix, in CSR format.
+        """
+
+        dtype = np.dtype(dtype)
+        cache = self.sparse_cache
+        if (cache is not None and cache['map_width'] == map_width and
+                cache['stencil'].dtype == dtype):
+            return cache['stencil']
+
+        size = map_width + 6
+        index = np.arange(size * size).reshape(size, size)
+        rows, cols, values = [], [], []
+        for stencil, r, c in self.stencil_regions(map_width):
+            points = index[r, c].ravel()
+            for coefficient, dx, dy in stencil:
+                rows.append(points)
+                cols.append(index[r.start+dx:r.stop+dx,
+                                  c.start+dy:c.stop+dy].ravel())
+                values.append(np.full(points.size, coefficient, dtype=dtype))
+
+        stencil = scipy.sparse.csr_matrix((np.concatenate(values),
+                                           (np.concatenate(rows),
+                                            np.concatenate(cols))),
+                                          shape=(size * size, size * size))
+        self.sparse_cache = {'map_width': map_width, 'stencil': stencil,
+                             'pressure': dtype.type(self.beta) * stencil,
+                             'diffusion': []}
+
+        return stencil
+
+    def sparse_operators(self, map_width, dif_field):
+        """
+        Finds the sparse operators of one explicit step of a Magic field: the
+        diffusion operator, which is the stencil matrix weighted by the
+        diffusion field, and the pressure operator, which is shared by every
+        field. The diffusion operator of each diffusion field is kept and
+        only assembled again if that field changes.
+
+        :param map_width: The number of points across the region of interest.
+        :param dif_field: The diffusion field of the Magic field.
+        :return: The diffusion and pressure operators, in CSR format.
+        """
+
+        stencil = self.stencil_operator(map_width, dif_field.dtype)
+        cache = self.sparse_cache
+        for values, operator in cache['diffusion']:
+            if np.array_equal(values, dif_field):
+                return operator, cache['pressure']
+
+        operator = (stencil @ scipy.sparse.diags(dif_field.ravel())).tocsr()
+        cache['diffusion'] = (cache['diffusion'] +
+                              [(dif_field.copy(), operator)])[-2:]
+
+        return operator, cache['pressure']
+
+    def sparse_fields_step(self, fields, pres_field, tstep, map_width):
+        """
+        Finds one or more Magic fields which share a pressure field at the
+        next time step with sparse matrix-vector products. The pressure
+        term is only found once and is then used for every field.
+
+        :param fields: A list of (Magic field, diffusion field) pairs.
+        :param pres_field: The array which corresponds to the sum of Magics
+                           at a point.
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        """
+
+        size = map_width + 6
+        inner = slice(1, map_width + 5)
+        pressure = None
+        for magic_field, dif_field in fields:
+            diffusion, pressure_operator = self.sparse_operators(map_width,
+                                                                 dif_field)
+            if pressure is None:
+                pressure = pressure_operator @ pres_field[tstep-1].ravel()
+            previous = magic_field[tstep-1]
+            change = (diffusion @ previous.ravel() + pressure).reshape(size,
+                                                                       size)
+            magic_field[tstep, inner, inner] = (previous[inner, inner] +
+                                                change[inner, inner])
+
+    def diffusion_operator(self, map_width):
+        """
+        Assembles the change made by one explicit step to Light and Dark,
+        stacked one after the other, as a sparse matrix. The pressure is
+        taken to be the sum of Light and Dark, as update_pressure keeps it,
+        which couples the two fields.
+
+        :param map_width: The number of points across the region of interest.
+        :return: The operator M, so that one explicit step of the stacked
+                 fields u is u + M u, in CSC format.
+        """
+
+        light, pressure = self.sparse_operators(map_width, self.DifLight)
+        dark, pressure = self.sparse_operators(map_width, self.DifDark)
+
+        return scipy.sparse.bmat([[light + pressure, pressure],
+                                  [pressure, dark + pressure]], format='csc')
+
+    def implicit_system(self, map_width, dt, theta):
+        """
+        Finds the operator and the factorised system of the implicit
+        integrator, only building them again if the map width, the step,
+        the weighting or a diffusion field has changed.
+
+        :param map_width: The number of points across the region of interest.
+        :param dt: The length of the step, as a number of explicit steps.
+        :param theta: The weighting of the implicit integrator.
+        :return: The operator M and the sparse LU factors of I - theta dt M.
+        """
+
+        cache = self.implicit_cache
+        if (cache is None or cache[:3] != (map_width, dt, theta) or
+                not np.array_equal(cache[3], self.DifLight) or
+                not np.array_equal(cache[4], self.DifDark)):
+            operator = self.diffusion_operator(map_width)
+            system = (scipy.sparse.identity(operator.shape[0], format='csc') -
+                      theta * dt * operator)
+            factors = scipy.sparse.linalg.splu(system.tocsc())
+            cache = (map_width, dt, theta, self.DifLight.copy(),
+                     self.DifDark.copy(), operator, factors)
+            self.implicit_cache = cache
+
+        return cache[5], cache[6]
+
+    def implicit_fields_step(self, tstep, map_width, dt=1.0, theta=0.5):
+        """
+        Finds Light and Dark at the next time step with the theta method,
+
+            (I - theta dt M) u_new = (I + (1 - theta) dt M) u_old,
+
+        where M is the diffusion_operator. A theta of 0.5 gives
+        Crank-Nicolson, which is second order in time, and a theta of 1
+        gives backward Euler. Both are stable for any step, so dt can be
+        many explicit steps long; a theta of 0 with a dt of 1 is the explicit
+        step. The outer edge is held at its previous values during the step.
+
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        :param dt: The length of the step, as a number of explicit steps.
+        :param theta: The weighting given to the new time step.
+        """
+
+        operator, factors = self.implicit_system(map_width, dt, theta)
+        size = map_width + 6
+        previous = np.concatenate([self.Light[tstep-1].ravel(),
+                                   self.Dark[tstep-1].ravel()])
+
+        right = previous
+        if theta != 1:
+            right = previous + (1 - theta) * dt * (operator @ previous)
+        new = factors.solve(right.astype(float)).reshape(2, size, size)
+
+        w = map_width + 4
+        self.Light[tstep, 1:w+1, 1:w+1] = new[0, 1:w+1, 1:w+1]
+        self.Dark[tstep, 1:w+1, 1:w+1] = new[1, 1:w+1, 1:w+1]
+
+    def spectral_available(self):
+        """
+        Checks whether the spectral solver can be used. It needs diffusion
+        fields which are the same everywhere and periodic boundaries, since
+        it treats the map as wrapping around on itself.
+
+        :return: True if the spectral solver can be used.
+        """
+
+        return (np.ptp(self.DifLight) == 0 and np.ptp(self.DifDark) == 0 and
+                isinstance(self.light_boundary, PeriodicBoundary) and
+                isinstance(self.dark_boundary, PeriodicBoundary))
+
+    def spectral_symbol(self, n):
+        """
+        Finds the Fourier symbol of the roi stencil on a periodic grid, which
+        is the factor the stencil multiplies each Fourier mode by.
+
+        :param n: The number of points across the periodic grid.
+        :return: An (n, n // 2 + 1) array of the symbol at each mode of a
+                 real two-dimensional FFT.
+        """
+
+        kx = 2 * np.pi * np.fft.fftfreq(n)[:, np.newaxis]
+        ky = 2 * np.pi * np.fft.rfftfreq(n)[np.newaxis, :]
+        symbol = np.zeros((n, n // 2 + 1))
+        for coefficient, dx, dy in self.ROI_STENCIL:
+            symbol += coefficient * np.cos(kx * dx + ky * dy)
+
+        return symbol
+
+    def spectral_fields_step(self, tstep, map_width, steps=1):
+        """
+        Finds Light and Dark a number of explicit steps ahead at once with
+        FFTs. The diffusion fields are taken to be the same everywhere and
+        the points updated by the stencils to wrap around periodically, so
+        the roi stencil is a convolution and each Fourier mode of Light and
+        Dark changes independently of the others. With the pressure being
+        the sum of Light and Dark, one explicit step multiplies each mode by
+
+            I + symbol [[DifLight + beta, beta], [beta, DifDark + beta]],
+
+        and that 2 by 2 matrix is raised to the number of steps through its
+        eigenvectors, so any number of steps costs the same two FFTs.
+
+        This is not the same as the explicit stencils, even with periodic
+        boundaries. The stencils use the narrower buffer stencils near the
+        edge, while the FFT uses the roi stencil everywhere and wraps it
+        around, so the two differ most near the edge and least at the
+        centre.
+
+        :param tstep: The time step for which these values will be calculated.
+        :param map_width: The number of points across the region of interest.
+        :param steps: The number of explicit steps to take.
+        """
+
+        n = map_width + 4
+        inner = slice(1, n + 1)
+        coupling = np.array([[self.DifLight.flat[0] + self.beta, self.beta],
+                             [self.beta, self.DifDark.flat[0] + self.beta]],
+                            dtype=float)
+        eigenvalues, vectors = np.linalg.eigh(coupling)
+        symbol = self.spectral_symbol(n)
+
+        light = np.fft.rfft2(self.Light[tstep-1, inner, inner])
+        dark = np.fft.rfft2(self.Dark[tstep-1, inner, inner])
+        modes = []
+        for k in range(2):
+            mode = vectors[0, k] * light + vectors[1, k] * dark
+            modes.append(mode * (1 + symbol * eigenvalues[k]) ** steps)
+
+        light = vectors[0, 0] * modes[0] + vectors[0, 1] * modes[1]
+        dark = vectors[1, 0] * modes[0] + vectors[1, 1] * modes[1]
+        self.Light[tstep, inner, inner] = np.fft.irfft2(light, s=(n, n))
+        self.Dark[tstep, inner, inner] = np.fft.irfft2(dark, s=(n, n))
+
+    def stable_time_step(self, map_width, theta=0.0, safety=0.9,
+                         monotone=False):
+        """
+        Finds the longest step the theta method can take while staying
+        stable, using the Gershgorin bound on the eigenvalues of the
+        diffusion operator.
+
+        :param map_width: The number of points across the region of interest.
+        :param theta: The weighting of the implicit integrator; 0 is the
+                      explicit step.
+        :param safety: The fraction of the bound which is used.
+        :param monotone: If True, also keep the explicit part of the step
+                         free of the oscillations Crank-Nicolson can give
+                         with long steps.
+        :return: The longest step, as a number of explicit steps. This is
+                 infinite if every step is stable.
+        """
+
+        operator = self.diffusion_operator(map_width)
+        radius = abs(operator).sum(axis=1).max()
+        limit = np.inf
+        if radius == 0:
+            return limit
+
+        if theta < 0.5:
+            limit = 2 / ((1 - 2 * theta) * radius)
+        if monotone and theta < 1:
+            diagonal = abs(operator.diagonal()).max()
+            limit = min(limit, 1 / ((1 - theta) * diagonal))
+
+        return safety * limit
+
+    def choose_time_step(self, map_width, dt, theta=0.5, safety=0.9,
+                         monotone=False):
+        """
+        Limits a wanted step to the longest stable step of the theta method.
+
+        :param map_width: The number of points across the region of interest.
+        :param dt: The wanted step, as a number of explicit steps.
+        :param theta: The weighting of the implicit integrator.
+        :param safety: The fraction of the stability bound which is used.
+        :param monotone: If True, also avoid oscillations in the solution.
+        :return: The step to take.
+        """
+
+        return min(dt, self.stable_time_step(map_width, theta, safety,
+                                             monotone))
+
+    def stream_map(self, filename, compression=None, resume_at=None):
+        """
+        Opens a file which Light, Dark and the pressure are written into one
+        time step at a time, along with the diffusion fields which do not
+        change. Each time step has the buffered shape made by
+        prepare_map_arrays.
+
+        :param filename: The name of the file, without its extension.
+        :param compression: The HDF5 compression filter to use, such as
+                            'gzip' or 'lzf', or None for no compression.
+        :param resume_at: If given, carry on writing the file from this time
+                          step, as when restarting from a checkpoint.
+        :return: The StreamWriter to give to run.
+        """
+
+        frame = (self.DifLight.shape, self.DifLight.dtype)
+        writer = StreamWriter(filename + '.h5',
+                              {'Light': frame, 'Dark': frame,
+                               'LDPressure': frame},
+                              compression=compression, resume_at=resume_at)
+        if resume_at is None:
+            writer.add_static('DifLight', self.DifLight)
+            writer.add_static('DifDark', self.DifDark)
+
+        return writer
+
+    def write_time_step(self, writer, tstep):
+        """
+        Writes one time step of Light, Dark and the pressure to a file opened
+        by stream_map.
+
+        :param writer: The StreamWriter from stream_map.
+        :param tstep: The time step to write.
+        """
+
+        writer.append(Light=self.Light[tstep], Dark=self.Dark[tstep],
+                      LDPressure=self.LDPressure[tstep])
+
+    def save_map(self, filename, compression=None):
+        """
+        Saves the map in one go, in the same layout as stream_map. Only the
+        time steps which are still held are saved if the map keeps a rolling
+        history.
+
+        :param filename: The name of the file, without its extension.
+        :param compression: The HDF5 compression filter to use, or None.
+        """
+
+        # The history may be an array, a time store or the datasets of a
+        # lazily loaded map, so it is written one time step at a time.
+        first = getattr(self.Light, 'first_time', 0)
+        with self.stream_map(filename, compression) as writer:
+            for tstep in range(first, len(self.Light)):
+                self.write_time_step(writer, tstep)
+
+    def load_map(self, filename, lazy=False):
+        """
+        Loads a map saved by save_map or stream_map.
+
+        :param filename: The name of the file, without its extension.
+        :param lazy: If False, read every time step into memory. If True,
+                     keep the file open and back Light, Dark and the
+                     pressure with its datasets, so only the slices which
+                     are asked for are read. A lazily loaded map is
+                     read-only and should be closed with close_map.
+        :return: The number of points across the region of interest and the
+                 number of time steps in the file.
+        """
+
+        self.close_map()
+        h5handle = h5.File(filename + '.h5', 'r')
+        self.DifLight = h5handle['DifLight'][:]
+        self.DifDark = h5handle['DifDark'][:]
+        self.dtype = self.DifLight.dtype
+
+        for name in ['Light', 'Dark', 'LDPressure']:
+            if lazy:
+                setattr(self, name, h5handle[name])
+            else:
+                setattr(self, name, self.as_time_store(h5handle[name][:]))
+
+        if lazy:
+            self.handle = h5handle
+        else:
+            h5handle.close()
+
+        return self.DifLight.shape[0] - 6, len(self.Light)
+
+    def close_map(self):
+        """ Closes the file behind a lazily loaded map, if there is one. """
+
+        if self.handle is not None:
+            self.Light = self.Dark = self.LDPressure = None
+            self.handle.close()
+            self.handle = None
+
+    def run(self, start, stop, map_width, vectorised=True, backend='numpy',
+            workers=1, checkpoint=None, checkpoint_every=100, writer=None,
+            integrator='explicit', dt=1.0, theta=0.5, safety=None,
+            monotone=False):
+        """
+        Advances the map over a number of time steps, creating each next time
+        step as it goes.
+
+        :param start: The first time step to calculate.
+        :param stop: The time step to stop before.
+        :param map_width: The number of points across the region of interest.
+        :param vectorised: If False, fall back to the point-wise stencils.
+        :param backend: Either 'numpy', 'numba' or 'sparse'.
+        :param workers: The number of threads which advance tiles of the map
+                        in parallel.
+        :param checkpoint: The name of a checkpoint file, without its
+                           extension, to save the run to as it goes. The run
+                           can be restarted with load_checkpoint.
+        :param checkpoint_every: The number of time steps between
+                                 checkpoints. A checkpoint is always saved
+                                 after the last time step.
+        :param writer: A StreamWriter from stream_map, which each time step
+                       is written to as soon as it is found.
+        :param integrator: Either 'explicit', 'implicit', 'spectral' or
+                           'auto', as for step.
+        :param dt: The length of each step, as a number of explicit steps.
+        :param theta: The weighting of the implicit integrator.
+        :param safety: If given, the implicit integrator's step is limited by
+                       choose_time_step to this fraction of its longest
+                       stable step. The diffusion fields do not change
+                       during a run, so the step is chosen once at the
+                       start.
+        :param monotone: If True, the step chosen with safety is also kept
+                         free of oscillations.
+        """
+
+        if safety is not None:
+            if integrator != 'implicit':
+                raise ValueError('the step can only be chosen for the '
+                                 'implicit integrator')
+            dt = self.choose_time_step(map_width, dt, theta, safety, monotone)
+
+        for tstep in range(start, stop):
+            self.step(tstep, map_width, vectorised, backend, workers,
+                      integrator, dt, theta)
+            if writer is not None:
+                self.write_time_step(writer, tstep)
+            self.create_next_time_step()
+            if checkpoint is not None and ((tstep + 1 - start) %
+                                           checkpoint_every == 0 or
+                                           tstep == stop - 1):
+                self.save_checkpoint(checkpoint, tstep + 1)
+
+    def save_checkpoint(self, filename, tstep):
+        """
+        Saves the smallest state needed to carry on the run exactly: the
+        last two time steps of Light, Dark and pressure, the diffusion fields
+        and the state of the random number generator.
+
+        :param filename: The name of the checkpoint file, without its
+                         extension.
+        :param tstep: The next time step to be calculated.
+        """
+
+        fields = {'DifLight': self.DifLight, 'DifDark': self.DifDark}
+        for name in ['Light', 'Dark', 'LDPressure']:
+            field = getattr(self, name)
+            first = max(field.first_time, len(field) - 2)
+            fields[name] = field[first:]
+
+        save_checkpoint(filename + '.h5', fields,
+                        {'tstep': tstep,
+                         'length': len(self.Light),
+                         'history': self.history,
+                         'capacity': self.Light.capacity,
+                         'sampler_state': self.sampler.get_state()})
+
+    def load_checkpoint(self, filename):
+        """
+        Restores the map from a checkpoint saved by save_checkpoint, so that
+        run can carry on from where it was saved.
+
+        :param filename: The name of the checkpoint file, without its
+                         extension.
+        :return: The number of points across the region of interest and the
+                 next time step to be calculated.
+        """
+
+        fields, attributes = load_checkpoint(filename + '.h5')
+        self.history = attributes['history']
+        self.capacity = attributes['capacity']
+        if self.history == 'chunked':
+            self.capacity = None
+
+        for name in ['Light', 'Dark', 'LDPressure']:
+            setattr(self, name, TimeStore.resume(fields[name],
+                                                 attributes['length'],
+                                                 self.capacity, self.history))
+        self.DifLight = fields['DifLight']
+        self.DifDark = fields['DifDark']
+        self.dtype = self.DifLight.dtype
+        self.sampler.set_state(attributes['sampler_state'])
+
+        return self.DifLight.shape[0] - 6, attributes['tstep']
+
     def update_pressure(self, magic_field1, magic_field2, pres_field,
                         tstep, map_width):
         """
@@ -150,10 +1260,8 @@ class Map:
 
         w = map_width + 6
 
-        for i in range(w):
-            for j in range(w):
-                pres_field[tstep, i, j] = (magic_field1[tstep, i, j] +
-                                          magic_field2[tstep, i, j])
+        pres_field[tstep, :w, :w] = (magic_field1[tstep, :w, :w] +
+                                     magic_field2[tstep, :w, :w])
 
     def roi_stencil(self, magic_field, dif_field, pres_field, tstep, x, y):
         """
@@ -362,7 +1470,7 @@ class Map:
         magic_field[tstep, x, y] = magic_field[tstep - 1, x, y] + magic\
             + pressure * beta
 
-    def generate_BCs(self, magic_field, tstep, map_width):
+    def generate_BCs(self, magic_field, tstep, map_width, boundary=None):
         """
         For the entire outer edge of the map, this method will generate the
         boundary conditions for the current time step which are required to
@@ -374,34 +1482,17 @@ class Map:
         :param magic_field: The Magic field which needs its BCs calculated.
         :param tstep: The current time step.
         :param map_width: The number of points across the region of interest.
+        :param boundary: The boundary condition to use, from MapBoundaries.
+                         If not given, each edge is drawn at random around
+                         its previous values.
         """
 
-        w = map_width + 5
-
-        for i in range(1, w):
-            magic_field[tstep, i, 0] = skewnorm.rvs(0, loc=magic_field[
-                                                         tstep-1, i, 0],
-                                                     scale=10)
-
-            magic_field[tstep, i, w] = skewnorm.rvs((50/(100.1-magic_field[
-                                            tstep-1, i, w])),
-                                                     loc=magic_field[
-                                                         tstep-1, i, w],
-                                                     scale=15)
-
-            magic_field[tstep, 0, i] = skewnorm.rvs((50/(100.1-magic_field[
-                                            tstep-1, 0, i])),
-                                                     loc=magic_field[
-                                                         tstep-1, 0, i],
-                                                     scale=15)
-
-            magic_field[tstep, w, i] = skewnorm.rvs((50/(100.1-magic_field[
-                                            tstep-1, 0, i])),
-                                                     loc=magic_field[
-                                                         tstep-1, 0, i],
-                                                     scale=15)
+        if boundary is None:
+            boundary = self.stochastic_boundary
+        boundary.apply(self, magic_field, tstep, map_width)
 
-    def LD_forcing_functions(self, light_field, dark_field, tstep, map_width):
+    def LD_forcing_functions(self, light_field, dark_field, tstep, map_width,
+                             dt=1.0):
         """
         Enforces the generation and consumption of Magic which drives the
         systems.
@@ -410,12 +1501,15 @@ class Map:
         :param dark_field: The Magic Field corresponding to Dark Magic.
         :param tstep: The current time step.
         :param map_width: The number of points in the region of interest.
+        :param dt: The length of the step, as a number of explicit steps. The
+                   generation and consumption are scaled by it.
         """
 
         w = map_width + 5
 
         light_field[tstep, 11, 7] = (light_field[tstep, 11, 7] +
-                                     skewnorm.rvs(4, loc=200, scale=80))
-        consumption = light_field[tstep, 17, 10] * 1/5
+                                     self.sampler.rvs(4, loc=200, scale=80) *
+                                     dt)
+        consumption = light_field[tstep, 17, 10] * 1/5 * dt
         light_field[tstep, 11, 15] = light_field[tstep, 11, 15] - consumption
         dark_field[tstep, 11, 15] = dark_field[tstep, 11, 15] + consumption
@@ -1,6 +1,6 @@
 # Author: Jack Adams
 # Date Started: 18/06/3
-# Last Updated: 18/06/3
+# Last Updated: 26/10/16
 
 # This file can run the functions associated with the Map to load, save, and
 # step through time for the regional map of Aramour.
@@ -13,14 +13,16 @@ Aramour = RegionMap()
 height = 50
 width = 70
 centre = np.array([25, 10])
-Aramour.initialise_map(height, width)
+Aramour.initialise_map(height, width, history='rolling')
 
-Aramour.find_magic(0, 1000, height, width, centre)
+# Each time step is written to the file as soon as it is found, so only the
+# last few need to be held in memory.
+with Aramour.stream_map('C:/Users/Jack/Desktop/seasonal_test', height, width,
+                        centre, compression='gzip') as writer:
+    Aramour.find_magic(0, 1000, height, width, centre, writer=writer)
 
 print("Done!")
 
-Aramour.save_map('C:/Users/Jack/Desktop/seasonal_test', centre)
-
 test = RegionMap()
 test.load_map('C:/Users/Jack/Desktop/test')
 print('done!')
\ No newline at end of file
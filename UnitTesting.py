@@ -1,7 +1,17 @@
 import unittest as test
 import MapStructures as MS
+import MapFunctions as MF
+import MapSampling as MSa
+import MapEnsembles as ME
+import MapStorage as MSt
+import MapBoundaries as MB
+import Benchmarks as BM
+import MapProfiling as MP
 import numpy as np
 import scipy as sp
+import h5py as h5
+import os
+import tempfile
 
 
 class TestMapSetup(test.TestCase):
@@ -44,6 +54,34 @@ class TestMapSetup(test.TestCase):
         self.assertEqual(test_map.DifDark[3, 3], 3)
         self.assertEqual(test_map.LDPressure[3, 3], 100)
 
+    def test_initialise_varying_values(self):
+        test_map = MS.Map()
+        test_map.prepare_map_arrays(4)
+        magic = np.arange(100.).reshape(10, 10)
+        test_map.initialise_values(magic, lambda i, j: 0.01 * (i + j))
+        self.assertTrue(np.array_equal(test_map.Dark, magic))
+        self.assertTrue(np.array_equal(test_map.LDPressure, 2 * magic))
+        self.assertAlmostEqual(test_map.DifLight[2, 5], 0.07)
+
+        # Functions which only handle a single point at a time also work.
+        test_map.initialise_values(lambda i, j: 5 if i < j else 1)
+        self.assertEqual(test_map.Light[2, 5], 5)
+        self.assertEqual(test_map.Light[5, 2], 1)
+        self.assertEqual(test_map.DifDark[5, 2], 1)
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'dif.npy')
+            np.save(filename, magic / 100)
+            test_map.initialise_values(dif_value=filename)
+            self.assertEqual(test_map.DifDark[1, 2], 0.12)
+            filename = os.path.join(folder, 'dif.txt')
+            np.savetxt(filename, magic)
+            test_map.initialise_values(dif_value=filename)
+            self.assertEqual(test_map.DifLight[1, 2], 12)
+
+        self.assertRaises(ValueError, test_map.initialise_values,
+                          np.ones((3, 3)))
+
     def test_create_next_time_step(self):
         test_map = MS.Map()
         test_map.prepare_map_arrays(1)
@@ -67,6 +105,72 @@ class TestMapSetup(test.TestCase):
             self.assertEqual(test_map.Light.shape[i], test_sizes3[i])
             self.assertEqual(test_map.Dark.shape[i], test_sizes3[i])
 
+    def test_rolling_history(self):
+        test_map = MS.Map()
+        test_map.prepare_map_arrays(1, history='rolling')
+        test_map.initialise_values(50, 3)
+        for i in range(5):
+            test_map.create_next_time_step()
+            test_map.Light[i+1, 3, 3] = i
+
+        self.assertEqual(test_map.Light.shape, (6, 7, 7))
+        self.assertEqual(test_map.Light.data.shape[0], 2)
+        self.assertEqual(test_map.Light[4, 3, 3], 3)
+        self.assertEqual(test_map.Light[-1, 3, 3], 4)
+        self.assertRaises(IndexError, test_map.Light.__getitem__, (3, 3, 3))
+
+
+class TestTimeStore(test.TestCase):
+
+    def test_chunked_growth(self):
+        store = MS.TimeStore((2, 2), capacity=2)
+        for i in range(5):
+            store.append(i * np.ones([2, 2]))
+
+        self.assertEqual(store.shape, (5, 2, 2))
+        self.assertEqual(store.data.shape[0], 8)
+        self.assertTrue(np.array_equal(np.asarray(store)[:, 0, 0],
+                                       np.arange(5)))
+        self.assertTrue(np.array_equal(store[1:4, 1, 1], [1, 2, 3]))
+
+    def test_rolling_window(self):
+        store = MS.TimeStore((2,), capacity=3, mode='rolling')
+        for i in range(7):
+            store.append([i, -i])
+
+        self.assertEqual(store.first_time, 4)
+        self.assertTrue(np.array_equal(np.asarray(store)[:, 0], [4, 5, 6]))
+        self.assertTrue(np.array_equal(store[-2], [5, -5]))
+        store[6, 1] = 10
+        self.assertEqual(store[6, 1], 10)
+        self.assertRaises(IndexError, store.__getitem__, 2)
+        self.assertRaises(ValueError, MS.TimeStore, (2,), 3, 'sliding')
+
+    def test_resumed_history(self):
+        store = MS.TimeStore.resume(np.arange(6.).reshape(3, 2), 10)
+        self.assertEqual(store.first_time, 7)
+        self.assertEqual(store.data.shape[0], store.chunk)
+        for i in range(70):
+            store.append([i, i])
+
+        self.assertEqual(store.shape, (80, 2))
+        self.assertTrue(np.array_equal(store[8], [2, 3]))
+        self.assertTrue(np.array_equal(store[9:6:-1, 0], [4, 2, 0]))
+        self.assertEqual(np.asarray(store).shape, (73, 2))
+        self.assertRaises(IndexError, store.__getitem__, 6)
+        self.assertRaises(IndexError, store.__getitem__, slice(None))
+
+    def test_reversed_slices(self):
+        for mode in ['chunked', 'rolling']:
+            store = MS.TimeStore((2,), capacity=8, mode=mode)
+            for i in range(5):
+                store.append([i, -i])
+
+            self.assertTrue(np.array_equal(store[::-1, 0], [4, 3, 2, 1, 0]))
+            self.assertTrue(np.array_equal(store[-2::-2, 0], [3, 1]))
+            self.assertTrue(np.array_equal(store[3:0:-1, 1], [-3, -2, -1]))
+            self.assertTrue(np.array_equal(store[-3:, 0], [2, 3, 4]))
+
 
 class TestFiniteDifferenceSchemes(test.TestCase):
 
@@ -304,5 +408,902 @@ class TestFiniteDifferenceSchemes(test.TestCase):
         self.assertEqual(test_map.Light[1, 3, 3], 100)
 
 
+class TestVectorisedStencils(test.TestCase):
+
+    def setUp(self):
+        # Build a pair of maps with identical random fields so that the two
+        # engines can be compared point by point.
+        self.width = 7
+        rng = np.random.default_rng(3)
+        size = self.width + 6
+        self.light = rng.uniform(50, 150, [2, size, size])
+        self.dif = rng.uniform(0.01, 0.1, [size, size])
+        self.pressure = rng.uniform(100, 300, [2, size, size])
+
+    def test_matches_point_wise_stencils(self):
+        test_map = MS.Map()
+        loop_light = self.light.copy()
+        fast_light = self.light.copy()
+
+        test_map.calculate_next_time_step(loop_light, self.dif, self.pressure,
+                                          1, self.width, vectorised=False)
+        test_map.calculate_next_time_step(fast_light, self.dif, self.pressure,
+                                          1, self.width)
+
+        self.assertTrue(np.array_equal(loop_light, fast_light))
+
+    def test_small_maps(self):
+        test_map = MS.Map()
+        for width in range(0, 4):
+            size = width + 6
+            loop_light = self.light[:, :size, :size].copy()
+            fast_light = self.light[:, :size, :size].copy()
+            dif = self.dif[:size, :size]
+            pressure = self.pressure[:, :size, :size]
+
+            test_map.calculate_next_time_step(loop_light, dif, pressure, 1,
+                                              width, vectorised=False)
+            test_map.calculate_next_time_step(fast_light, dif, pressure, 1,
+                                              width)
+
+            self.assertTrue(np.array_equal(loop_light, fast_light))
+
+    def test_compiled_backend(self):
+        # Without numba this falls back to the numpy engine, so the results
+        # should match either way.
+        test_map = MS.Map()
+        loop_light = self.light.copy()
+        compiled_light = self.light.copy()
+
+        test_map.calculate_next_time_step(loop_light, self.dif, self.pressure,
+                                          1, self.width, vectorised=False)
+        test_map.calculate_next_time_step(compiled_light, self.dif,
+                                          self.pressure, 1, self.width,
+                                          backend='numba')
+
+        self.assertTrue(np.array_equal(loop_light, compiled_light))
+
+    def test_sparse_backend(self):
+        test_map = MS.Map()
+        loop_light = self.light.copy()
+        sparse_light = self.light.copy()
+
+        test_map.calculate_next_time_step(loop_light, self.dif, self.pressure,
+                                          1, self.width, vectorised=False)
+        test_map.calculate_next_time_step(sparse_light, self.dif,
+                                          self.pressure, 1, self.width,
+                                          backend='sparse')
+        self.assertTrue(np.allclose(loop_light, sparse_light, rtol=1e-12))
+
+        # The operators are kept until the diffusion field changes.
+        operator, pressure = test_map.sparse_operators(self.width, self.dif)
+        self.assertIs(test_map.sparse_operators(self.width, self.dif)[0],
+                      operator)
+        changed = self.dif.copy()
+        changed[4, 4] += 1
+        self.assertIsNot(test_map.sparse_operators(self.width, changed)[0],
+                         operator)
+        self.assertIs(test_map.sparse_operators(self.width, changed)[1],
+                      pressure)
+
+    def test_tiled_workers(self):
+        test_map = MS.Map()
+        self.assertEqual(test_map.tiles(7, 3), [(1, 5), (5, 8), (8, 12)])
+
+        loop_light = self.light.copy()
+        test_map.calculate_next_time_step(loop_light, self.dif, self.pressure,
+                                          1, self.width, vectorised=False)
+        for backend in ['numpy', 'numba']:
+            tiled_light = self.light.copy()
+            test_map.calculate_next_time_step(tiled_light, self.dif,
+                                              self.pressure, 1, self.width,
+                                              backend=backend, workers=3)
+            self.assertTrue(np.array_equal(loop_light, tiled_light))
+
+
+class TestFusedStep(test.TestCase):
+
+    def run_map(self, fused, backend='numpy', workers=1, dtype=float):
+        test_map = MS.Map(seed=4)
+        width = 15
+        test_map.prepare_map_arrays(width, history='rolling', dtype=dtype)
+        test_map.initialise_values(100, 0.04)
+        test_map.create_next_time_step()
+        test_map.Light[0, 11, 11] = 150
+        test_map.LDPressure[0, 11, 11] = 250
+
+        for tstep in range(1, 6):
+            if fused:
+                test_map.step(tstep, width, backend=backend, workers=workers)
+            else:
+                for field, dif in [(test_map.Light, test_map.DifLight),
+                                   (test_map.Dark, test_map.DifDark)]:
+                    test_map.calculate_next_time_step(field, dif,
+                                                      test_map.LDPressure,
+                                                      tstep, width,
+                                                      vectorised=False)
+                test_map.generate_BCs(test_map.Light, tstep, width)
+                test_map.generate_BCs(test_map.Dark, tstep, width)
+                test_map.LD_forcing_functions(test_map.Light, test_map.Dark,
+                                              tstep, width)
+                test_map.update_pressure(test_map.Light, test_map.Dark,
+                                         test_map.LDPressure, tstep, width)
+            test_map.create_next_time_step()
+
+        return [np.asarray(field) for field in
+                (test_map.Light, test_map.Dark, test_map.LDPressure)]
+
+    def test_step_matches_separate_calls(self):
+        expected = self.run_map(False)
+        for backend in ['numpy', 'numba']:
+            for field, result in zip(expected, self.run_map(True, backend)):
+                self.assertTrue(np.array_equal(field, result))
+            for field, result in zip(expected, self.run_map(True, backend, 4)):
+                self.assertTrue(np.array_equal(field, result))
+
+    def test_single_precision(self):
+        expected = self.run_map(True)
+        single = self.run_map(True, dtype=np.float32)
+        for backend in ['numpy', 'numba', 'sparse']:
+            for field, numpy_field, result in zip(
+                    expected, single, self.run_map(True, backend,
+                                                   dtype=np.float32)):
+                self.assertEqual(result.dtype, np.float32)
+                self.assertTrue(np.allclose(field, result, rtol=1e-4))
+                # The backends all work in single precision, so they only
+                # differ by the order the sums are taken in.
+                if backend == 'sparse':
+                    self.assertTrue(np.allclose(numpy_field, result,
+                                                rtol=1e-5))
+                else:
+                    self.assertTrue(np.array_equal(numpy_field, result))
+
+        test_map = MS.Map()
+        self.assertEqual(test_map.sparse_operators(
+            5, np.ones([11, 11], dtype=np.float32))[0].dtype, np.float32)
+        self.assertRaises(ValueError, MS.Map().prepare_map_arrays, 5,
+                          dtype=int)
+
+
+class TestBoundaries(test.TestCase):
+
+    def setUp(self):
+        self.test_map = MS.Map(seed=5)
+        self.test_map.prepare_map_arrays(15)
+        self.test_map.initialise_values(lambda i, j: 10 * i + j, 0.04)
+        self.test_map.create_next_time_step()
+        self.test_map.Light[1] = self.test_map.Light[0]
+        self.w = 20
+
+    def edge_values(self, field):
+        w = self.w
+        return np.concatenate([field[1:w, 0], field[1:w, w], field[0, 1:w],
+                               field[w, 1:w]])
+
+    def test_stochastic(self):
+        self.test_map.generate_BCs(self.test_map.Light, 1, 15)
+        light = self.test_map.Light
+        self.assertFalse(np.any(self.edge_values(light[1]) ==
+                                self.edge_values(light[0])))
+        self.assertTrue(np.array_equal(light[1, 1:20, 1:20], light[0, 1:20, 1:20]))
+        self.assertEqual(light[1, 0, 0], light[0, 0, 0])
+
+    def test_fixed(self):
+        self.test_map.generate_BCs(self.test_map.Light, 1, 15,
+                                   MB.FixedBoundary(7))
+        self.assertTrue(np.all(self.edge_values(self.test_map.Light[1]) == 7))
+
+    def test_periodic(self):
+        self.test_map.generate_BCs(self.test_map.Light, 1, 15,
+                                   MB.PeriodicBoundary())
+        light = self.test_map.Light[1]
+        self.assertTrue(np.array_equal(light[1:20, 0], light[1:20, 19]))
+        self.assertTrue(np.array_equal(light[20, 1:20], light[1, 1:20]))
+
+    def test_file(self):
+        frames = np.arange(2 * 441.).reshape(2, 21, 21)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'edges.npy')
+            np.save(filename, frames)
+            boundary = MB.FileBoundary(filename)
+            self.test_map.Dark[1] = -1
+            self.test_map.dark_boundary = boundary
+            self.test_map.step(1, 15)
+            self.assertTrue(np.array_equal(
+                self.edge_values(self.test_map.Dark[1]),
+                self.edge_values(frames[1])))
+            boundary.close()
+
+            filename = os.path.join(folder, 'edges.h5')
+            with h5.File(filename, 'w') as handle:
+                handle.create_dataset('Dark', data=frames)
+            with MB.FileBoundary(filename, 'Dark') as boundary:
+                self.test_map.dark_boundary = boundary
+                self.test_map.create_next_time_step()
+                self.test_map.step(2, 15)
+                self.assertTrue(np.array_equal(
+                    self.edge_values(self.test_map.Dark[2]),
+                    self.edge_values(frames[0])))
+            self.assertIsNone(boundary.handle)
+
+        self.assertRaises(TypeError, MB.Boundary)
+
+    def test_region_map_edges(self):
+        region = MF.RegionMap(seed=2)
+        region.initialise_map(30, 40)
+        region.initialise_BCs(30, 40, 0)
+        self.assertTrue(np.all(region.magics[0, 9, :, 0] > 0))
+        self.assertTrue(np.all(region.magics[0, 9, :, 1:] == 0))
+        self.assertGreater(len(np.unique(region.magics[0, 7, 29])), 1)
+
+
+class TestImplicitIntegrator(test.TestCase):
+
+    def new_map(self):
+        test_map = MS.Map(seed=3)
+        test_map.prepare_map_arrays(15)
+        test_map.initialise_values(100, 0.04)
+        test_map.create_next_time_step()
+        test_map.Light[0, 11, 11] = 150
+        test_map.LDPressure[0, 11, 11] = 250
+        return test_map
+
+    def diffuse(self, steps, dt=1.0, theta=None):
+        """ Runs the diffusion alone, holding the outer edge fixed. """
+
+        test_map = self.new_map()
+        for tstep in range(1, steps + 1):
+            if theta is None:
+                test_map.advance_fields([(test_map.Light, test_map.DifLight),
+                                         (test_map.Dark, test_map.DifDark)],
+                                        test_map.LDPressure, tstep, 15)
+            else:
+                test_map.implicit_fields_step(tstep, 15, dt, theta)
+            for field in [test_map.Light, test_map.Dark]:
+                field[tstep, [0, -1]] = field[tstep-1, [0, -1]]
+                field[tstep, :, [0, -1]] = field[tstep-1, :, [0, -1]]
+            test_map.update_pressure(test_map.Light, test_map.Dark,
+                                     test_map.LDPressure, tstep, 15)
+            test_map.create_next_time_step()
+        return test_map.Light[steps]
+
+    def test_explicit_limit(self):
+        explicit = self.new_map()
+        explicit.run(1, 5, 15)
+        implicit = self.new_map()
+        implicit.run(1, 5, 15, integrator='implicit', theta=0.0)
+        self.assertTrue(np.allclose(explicit.Light[4], implicit.Light[4],
+                                    rtol=0, atol=1e-10))
+        self.assertRaises(ValueError, explicit.step, 5, 15, dt=2)
+
+    def test_crank_nicolson_long_steps(self):
+        reference = self.diffuse(40)
+        longer = self.diffuse(10, dt=4.0, theta=0.5)
+        self.assertLess(np.abs(longer - reference).max(), 0.05)
+
+    def test_stable_time_step(self):
+        test_map = self.new_map()
+        explicit = test_map.stable_time_step(15)
+        self.assertTrue(0.5 < explicit < 1.5)
+        self.assertEqual(test_map.stable_time_step(15, theta=0.5), np.inf)
+        monotone = test_map.stable_time_step(15, theta=0.5, monotone=True)
+        self.assertTrue(explicit < monotone < np.inf)
+        self.assertEqual(test_map.choose_time_step(15, 10, theta=0.0),
+                         explicit)
+        self.assertEqual(test_map.choose_time_step(15, 10), 10)
+
+    def test_controlled_run(self):
+        chosen = self.new_map()
+        chosen.run(1, 4, 15, integrator='implicit', dt=3.0, theta=0.5,
+                   safety=0.9, monotone=True)
+        dt = chosen.stable_time_step(15, 0.5, 0.9, monotone=True)
+        self.assertLess(dt, 3.0)
+
+        given = self.new_map()
+        given.run(1, 4, 15, integrator='implicit', dt=dt, theta=0.5)
+        self.assertTrue(np.array_equal(np.asarray(chosen.Light),
+                                       np.asarray(given.Light)))
+        self.assertRaises(ValueError, given.run, 4, 5, 15, safety=0.9)
+
+
+class TestSpectralSolver(test.TestCase):
+
+    def setUp(self):
+        self.test_map = MS.Map(seed=7)
+        self.test_map.prepare_map_arrays(15)
+        self.test_map.initialise_values(
+            lambda i, j: 100 + 5 * np.sin(i / 3) * np.cos(j / 2), 0.03)
+        self.test_map.create_next_time_step()
+        self.test_map.light_boundary = MB.PeriodicBoundary()
+        self.test_map.dark_boundary = MB.PeriodicBoundary()
+
+    def periodic_steps(self, light, dark, steps):
+        """ Applies the roi stencil with wrap-around, one step at a time. """
+
+        def stencil(field, weight):
+            return sum(coefficient * weight * np.roll(field, (-dx, -dy),
+                                                      axis=(0, 1))
+                       for coefficient, dx, dy in MS.Map.ROI_STENCIL)
+
+        for step in range(steps):
+            pressure = stencil(light + dark, 1) * 0.02
+            light, dark = (light + stencil(light, 0.03) + pressure,
+                           dark + stencil(dark, 0.03) + pressure)
+        return light, dark
+
+    def test_jump_matches_periodic_stencil(self):
+        inner = slice(1, 20)
+        light, dark = self.periodic_steps(self.test_map.Light[0, inner, inner],
+                                          self.test_map.Dark[0, inner, inner],
+                                          6)
+        self.test_map.spectral_fields_step(1, 15, steps=6)
+        self.assertTrue(np.allclose(self.test_map.Light[1, inner, inner],
+                                    light))
+        self.assertTrue(np.allclose(self.test_map.Dark[1, inner, inner], dark))
+
+    def test_difference_from_stencils(self):
+        stencils = self.test_map
+        spectral = MS.Map(seed=7)
+        spectral.prepare_map_arrays(15)
+        spectral.initialise_values(
+            lambda i, j: 100 + 5 * np.sin(i / 3) * np.cos(j / 2), 0.03)
+        spectral.create_next_time_step()
+        spectral.light_boundary = MB.PeriodicBoundary()
+        spectral.dark_boundary = MB.PeriodicBoundary()
+
+        stencils.run(1, 4, 15)
+        spectral.run(1, 4, 15, integrator='spectral')
+
+        # The buffer stencils near the edge make the two differ, most of all
+        # at the edge and hardly at all at the centre.
+        roi = slice(3, 18)
+        scale = np.abs(stencils.Light[3, roi, roi]).max()
+        difference = np.abs(stencils.Light[3] - spectral.Light[3])
+        self.assertGreater(difference.max(), 0)
+        self.assertLess(difference[roi, roi].max(), 1e-4 * scale)
+        self.assertLess(difference.max(), 5e-3 * scale)
+        self.assertLess(difference[10, 10], 1e-9 * scale)
+
+    def test_auto_selection(self):
+        self.assertTrue(self.test_map.spectral_available())
+        self.test_map.run(1, 3, 15, integrator='auto', dt=3)
+        self.assertRaises(ValueError, self.test_map.step, 3, 15,
+                          integrator='spectral', dt=1.5)
+
+        self.test_map.DifDark[4, 4] = 1
+        self.assertFalse(self.test_map.spectral_available())
+        self.test_map.dark_boundary = None
+        self.test_map.DifDark[4, 4] = 0.03
+        self.assertFalse(self.test_map.spectral_available())
+
+
+class TestSkewNormSampler(test.TestCase):
+
+    def test_grid_moments(self):
+        # The sample mean and variance over a large grid should match those
+        # of scipy's skew-normal distribution.
+        sampler = MSa.SkewNormSampler(7)
+        for a, loc, scale in [(0, 3, 0.5), (4, 0, 1.4), (-2, 1, 0.3)]:
+            values = sampler.rvs(a * np.ones([400, 500]), loc, scale)
+            mean, var = sp.stats.skewnorm.stats(a, loc=loc, scale=scale)
+            self.assertEqual(values.shape, (400, 500))
+            self.assertAlmostEqual(values.mean(), mean, places=2)
+            self.assertAlmostEqual(values.var(), var, places=2)
+
+    def test_per_point_parameters(self):
+        sampler = MSa.SkewNormSampler(7)
+        loc = np.array([[0], [100]])
+        values = sampler.rvs(1, loc=loc, scale=np.full([2, 1000], 0.1))
+        self.assertEqual(values.shape, (2, 1000))
+        self.assertTrue(np.all(values[0] < 50))
+        self.assertTrue(np.all(values[1] > 50))
+
+    def test_seeded_runs_repeat(self):
+        maps = []
+        for i in range(2):
+            region = MF.RegionMap(seed=11)
+            region.initialise_map(5, 6)
+            region.find_magic(0, 3, 5, 6, np.array([2, 1]))
+            maps.append(np.asarray(region.magics))
+        self.assertTrue(np.array_equal(maps[0], maps[1]))
+
+
+class ShiftSampler:
+    """ A stand-in sampler whose values depend on, but do not vary with, the
+    parameters so that two ways of generating Magic can be compared. """
+
+    def rvs(self, a, loc=0, scale=1, size=None):
+        value = loc + 0.6 * scale * np.tanh(a)
+        if size is not None:
+            value = np.broadcast_to(value, size)
+        return value
+
+
+class TestVectorisedRegionMap(test.TestCase):
+
+    def run_region(self, vectorised):
+        region = MF.RegionMap()
+        region.sampler = ShiftSampler()
+        region.initialise_map(6, 9)
+        region.find_magic(0, 4, 6, 9, np.array([2, 3]), vectorised=vectorised)
+        return np.asarray(region.magics)
+
+    def test_matches_point_wise_generators(self):
+        self.assertTrue(np.array_equal(self.run_region(False),
+                                       self.run_region(True)))
+
+    def test_values_clamped(self):
+        region = MF.RegionMap(seed=5)
+        region.initialise_map(8, 10)
+        region.find_magic(0, 3, 8, 10, np.array([4, 2]))
+        magics = np.asarray(region.magics)[:-1]
+        self.assertTrue(np.all(magics >= 0))
+        self.assertTrue(np.all(magics <= 4))
+        self.assertTrue(np.all(magics == np.round(magics)))
+
+    def test_average_fields(self):
+        region = MF.RegionMap()
+        region.initialise_map(5, 6)
+        region.magics[0] = np.random.default_rng(2).integers(0, 5, [12, 5, 6])
+        lr = region.find_LR_average_field(0, 9)
+        tb = region.find_TB_average_field(0, 4)
+        bt = region.find_BT_average_field(0, 6)
+
+        for y in range(5):
+            for x in range(6):
+                if x != 0:
+                    self.assertEqual(lr[y, x],
+                                     region.find_LR_average(5, 0, 9, y, x))
+                if y != 0:
+                    self.assertEqual(tb[y, x],
+                                     region.find_TB_average(6, 0, 4, y, x))
+                if y != 4:
+                    self.assertEqual(bt[y, x],
+                                     region.find_BT_average(6, 0, 6, y, x))
+        self.assertTrue(np.all(np.isnan(lr[:, 0])))
+        self.assertTrue(np.all(np.isnan(tb[0])))
+        self.assertTrue(np.all(np.isnan(bt[4])))
+
+    def test_geometry_cache(self):
+        geometry = MF.RegionGeometry.for_map(5, 6, np.array([2, 3]))
+        self.assertIs(geometry, MF.RegionGeometry.for_map(5, 6, (2, 3)))
+        self.assertIsNot(geometry, MF.RegionGeometry.for_map(5, 6, (1, 3)))
+        self.assertEqual(geometry.decay_loc_y.shape, (5, 1))
+        self.assertEqual(geometry.growth_loc_x.shape, (6,))
+        self.assertEqual(geometry.distance[2, 0], 3)
+        self.assertFalse(geometry.light_decay.flags.writeable)
+
+    def test_neighbour_average(self):
+        region = MF.RegionMap()
+        values = np.array([[1., 2., 6.], [4., 8., 0.]])
+        self.assertTrue(np.allclose(region.neighbour_average(values),
+                                    [[1.5, 3., 4.], [6., 4., 4.]]))
+        self.assertTrue(np.allclose(region.neighbour_average(values, axis=0),
+                                    [[2.5, 5., 3.], [2.5, 5., 3.]]))
+
+    def test_compact_storage(self):
+        centre = np.array([4, 3])
+        for vectorised in [True, False]:
+            full = MF.RegionMap(seed=12)
+            full.initialise_map(7, 9)
+            full.find_magic(0, 4, 7, 9, centre, vectorised)
+
+            compact = MF.RegionMap(seed=12)
+            compact.initialise_map(7, 9, dtype=np.uint8)
+            compact.find_magic(0, 4, 7, 9, centre, vectorised)
+
+            self.assertEqual(compact.magics.dtype, np.uint8)
+            self.assertTrue(np.array_equal(np.asarray(compact.magics, float),
+                                           np.asarray(full.magics)))
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'compact')
+            compact.save_map(filename, centre)
+            with h5.File(filename + '.h5', 'r') as handle:
+                self.assertEqual(handle['magic_arrays'].dtype, np.uint8)
+
+    def test_parallel_families(self):
+        centre = np.array([3, 4])
+        runs = []
+        for workers in [1, 3]:
+            region = MF.RegionMap(seed=8)
+            region.initialise_map(7, 9)
+            region.find_magic(0, 4, 7, 9, centre, progress=False,
+                              workers=workers)
+            runs.append(np.asarray(region.magics))
+
+        self.assertTrue(np.array_equal(runs[0], runs[1]))
+        self.assertTrue(np.all(runs[1] >= 0) and np.all(runs[1] <= 4))
+        # Shadow is only found once both Light and Dark have been.
+        self.assertTrue(np.all(np.minimum(runs[1][:-1, 0],
+                                          runs[1][:-1, 1]) == 0))
+
+        # A run restarted from a checkpoint carries on each family's stream.
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'families')
+            first = MF.RegionMap(seed=8)
+            first.initialise_map(7, 9)
+            first.find_magic(0, 2, 7, 9, centre, checkpoint=filename,
+                             progress=False, workers=2)
+            second = MF.RegionMap()
+            height, width, time, centre = second.load_checkpoint(filename)
+            second.find_magic(time, 4, height, width, centre, progress=False,
+                              workers=2)
+            self.assertTrue(np.array_equal(second.magics[3], runs[0][3]))
+
+    def test_row_blocks(self):
+        centre = np.array([5, 2])
+        runs = []
+        for workers, block_workers in [(None, 1), (None, 3), (2, 4)]:
+            region = MF.RegionMap(seed=4)
+            region.block_rows = 2
+            region.initialise_map(11, 8)
+            region.find_magic(0, 4, 11, 8, centre, progress=False,
+                              workers=workers, block_workers=block_workers)
+            runs.append(np.asarray(region.magics))
+
+        # The blocks are fixed, so the number of threads changes nothing.
+        self.assertTrue(np.array_equal(runs[0], runs[1]))
+        self.assertTrue(np.all(runs[1] >= 0) and np.all(runs[1] <= 4))
+
+        region = MF.RegionMap(seed=4)
+        region.block_rows = 2
+        region.initialise_map(11, 8)
+        region.find_magic(0, 4, 11, 8, centre, progress=False, workers=2,
+                          block_workers=1)
+        self.assertTrue(np.array_equal(np.asarray(region.magics), runs[2]))
+
+        # The families of a short, wide Map have different numbers of rows,
+        # and are found at the same time as each other's blocks.
+        for block_workers in [8, 3]:
+            region = MF.RegionMap(seed=2)
+            region.block_rows = 1
+            region.initialise_map(4, 30)
+            region.find_magic(0, 5, 4, 30, np.array([2, 6]), progress=False,
+                              workers=4, block_workers=block_workers)
+            runs.append(np.asarray(region.magics))
+        self.assertTrue(np.array_equal(runs[-2], runs[-1]))
+
+
+class TestEnsemble(test.TestCase):
+
+    def test_region_ensemble(self):
+        summaries = [ME.Ensemble(4, seed=9, workers=workers).run_region_maps(
+            0, 5, 6, 8, np.array([3, 2]), record_every=2)
+            for workers in [1, 2]]
+
+        summary = summaries[0]
+        self.assertEqual(list(summary.times), [0, 2, 4])
+        self.assertEqual(summary.mean.shape, (3, 12, 6, 8))
+        self.assertEqual(summary.quantile_fields.shape, (3, 3, 12, 6, 8))
+        self.assertTrue(np.any(summary.spread > 0))
+        self.assertTrue(np.all(summary.quantile_fields[:, 0] <=
+                               summary.quantile_fields[:, 2]))
+        self.assertTrue(np.array_equal(summary.mean, summaries[1].mean))
+
+    def test_process_pool(self):
+        centre = np.array([3, 2])
+        threads = ME.Ensemble(3, seed=4, workers=1).run_region_maps(
+            2, 5, 6, 8, centre, record_every=2)
+        processes = ME.Ensemble(3, seed=4, workers=2, processes=True)\
+            .run_region_maps(2, 5, 6, 8, centre, record_every=2)
+
+        self.assertEqual(list(threads.times), [2, 4])
+        self.assertTrue(np.array_equal(threads.mean, processes.mean))
+        self.assertTrue(np.array_equal(threads.quantile_fields,
+                                       processes.quantile_fields))
+
+    def test_start_and_records(self):
+        ensemble = ME.Ensemble(2, seed=1, workers=1)
+        summary = ensemble.run_maps(5, 8, 12, 100, 0.04)
+        self.assertEqual(list(summary.times), [7])
+        self.assertEqual(summary.mean.shape, (1, 3, 18, 18))
+        self.assertRaises(ValueError, ensemble.run_maps, 0, 3, 12)
+        self.assertRaises(ValueError, ensemble.run_region_maps, 3, 3, 6, 8,
+                          np.array([3, 2]))
+
+    def test_map_ensemble(self):
+        def setup(member):
+            member.Light[0, 11, 11] = 150
+
+        ensemble = ME.Ensemble(3, seed=2)
+        summary = ensemble.run_maps(1, 4, 12, 100, 0.04, setup=setup,
+                                    record_every=1)
+        self.assertEqual(summary.mean.shape, (3, 3, 18, 18))
+        self.assertTrue(np.allclose(summary.mean[:, 2],
+                                    summary.mean[:, 0] + summary.mean[:, 1]))
+        self.assertTrue(np.any(summary.spread[-1, 0] > 0))
+        self.assertRaises(ValueError, ME.Ensemble, 0)
+
+
+class TestStreamWriter(test.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'stream')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_streamed_run(self):
+        centre = np.array([3, 2])
+        region = MF.RegionMap(seed=5)
+        region.initialise_map(6, 8, history='rolling')
+        with region.stream_map(self.filename, 6, 8, centre,
+                               compression='gzip') as writer:
+            region.find_magic(0, 4, 6, 8, centre, writer=writer)
+
+        full = MF.RegionMap(seed=5)
+        full.initialise_map(6, 8)
+        full.find_magic(0, 4, 6, 8, centre)
+
+        with h5.File(self.filename + '.h5', 'r') as handle:
+            self.assertEqual(handle['magic_arrays'].chunks, (1, 12, 6, 8))
+            self.assertTrue(np.array_equal(handle['centre_location'][:],
+                                           centre))
+        loaded = MF.RegionMap()
+        self.assertEqual(loaded.load_map(self.filename), (6, 8, 4))
+        self.assertTrue(np.array_equal(np.asarray(loaded.magics),
+                                       np.asarray(full.magics)[:4]))
+
+    def test_partial_file_is_readable(self):
+        writer = MSt.StreamWriter(self.filename + '.h5',
+                                  {'field': ((3, 4), float)})
+        writer.append(field=np.ones((3, 4)))
+
+        # Copy the file as it is on disk while the writer is still open, as
+        # if the run had stopped here.
+        with open(self.filename + '.h5', 'rb') as source:
+            with open(self.filename + '_copy.h5', 'wb') as copy:
+                copy.write(source.read())
+        writer.close()
+
+        with h5.File(self.filename + '_copy.h5', 'r') as handle:
+            self.assertEqual(handle['field'].shape, (1, 3, 4))
+            self.assertTrue(np.all(handle['field'][0] == 1))
+
+    def test_chunk_shape(self):
+        writer = MSt.StreamWriter(self.filename + '.h5', {})
+        writer.chunk_bytes = 8 * 1000
+        self.assertEqual(writer.chunk_shape((12, 50, 70), 8), (1, 1, 13, 70))
+        self.assertEqual(writer.chunk_shape((3, 4), 8), (1, 3, 4))
+        writer.close()
+
+
+class TestLazyLoad(test.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'saved')
+        self.region = MF.RegionMap(seed=3)
+        self.region.initialise_map(5, 7)
+        self.region.find_magic(0, 3, 5, 7, np.array([2, 3]))
+        self.region.save_map(self.filename, np.array([2, 3]))
+        self.full = np.asarray(self.region.magics)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_lazy_modes(self):
+        for lazy in [False, True, 'mmap']:
+            loaded = MF.RegionMap()
+            self.assertEqual(loaded.load_map(self.filename, lazy=lazy),
+                             (5, 7, 4))
+            self.assertTrue(np.array_equal(loaded.magics[1, 4, 1:3, 2:6],
+                                           self.full[1, 4, 1:3, 2:6]))
+            loaded.close_map()
+
+        loaded = MF.RegionMap()
+        loaded.load_map(self.filename, lazy='mmap')
+        self.assertIsInstance(loaded.magics, np.memmap)
+        loaded.close_map()
+        self.assertIsNone(loaded.handle)
+
+    def test_print_region(self):
+        loaded = MF.RegionMap()
+        loaded.load_map(self.filename, lazy=True)
+        self.assertTrue(np.array_equal(loaded.print_region(2, 1, 4, 0, 3),
+                                       self.full[2, :, 1:4, 0:3]))
+        self.assertTrue(np.array_equal(loaded.print_region(2, 1, 4, 0, 3, 5),
+                                       self.full[2, 5, 1:4, 0:3]))
+        loaded.close_map()
+
+
+class TestCheckpoint(test.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'checkpoint')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_region_restart(self):
+        centre = np.array([3, 2])
+        full = MF.RegionMap(seed=8)
+        full.initialise_map(6, 8)
+        full.find_magic(0, 6, 6, 8, centre)
+
+        first = MF.RegionMap(seed=8)
+        first.initialise_map(6, 8, history='rolling')
+        first.find_magic(0, 3, 6, 8, centre, checkpoint=self.filename,
+                         checkpoint_every=2)
+
+        restarted = MF.RegionMap()
+        height, width, time, saved = restarted.load_checkpoint(self.filename)
+        self.assertEqual((height, width, time), (6, 8, 3))
+        self.assertTrue(np.array_equal(saved, centre))
+        restarted.find_magic(time, 6, height, width, saved)
+        self.assertTrue(np.array_equal(restarted.magics[5], full.magics[5]))
+        self.assertFalse(os.path.exists(self.filename + '.h5.tmp'))
+
+    def test_map_restart(self):
+        def start_map():
+            aramour = MS.Map(seed=6)
+            aramour.prepare_map_arrays(15)
+            aramour.initialise_values(100, 0.04)
+            aramour.create_next_time_step()
+            aramour.Light[0, 11, 11] = 150
+            aramour.LDPressure[0, 11, 11] = 250
+            return aramour
+
+        full = start_map()
+        full.run(1, 7, 15)
+
+        first = start_map()
+        first.run(1, 4, 15, checkpoint=self.filename)
+        restarted = MS.Map()
+        self.assertEqual(restarted.load_checkpoint(self.filename), (15, 4))
+        restarted.run(4, 7, 15)
+
+        self.assertEqual(len(restarted.Light), len(full.Light))
+        for name in ['Light', 'Dark', 'LDPressure']:
+            self.assertTrue(np.array_equal(getattr(restarted, name)[6],
+                                           getattr(full, name)[6]))
+
+    def test_resumed_stream(self):
+        writer = MSt.StreamWriter(self.filename + '.h5',
+                                  {'field': ((2,), float)})
+        for value in range(4):
+            writer.append(field=np.full(2, value))
+        writer.close()
+
+        writer = MSt.StreamWriter(self.filename + '.h5',
+                                  {'field': ((2,), float)}, resume_at=2)
+        writer.append(field=np.full(2, 7))
+        writer.close()
+        with h5.File(self.filename + '.h5', 'r') as handle:
+            self.assertTrue(np.array_equal(handle['field'][:, 0], [0, 1, 7]))
+
+
+class TestMapStorage(test.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, 'map')
+        self.aramour = MS.Map(seed=1)
+        self.aramour.prepare_map_arrays(15)
+        self.aramour.initialise_values(100, 0.04)
+        self.aramour.create_next_time_step()
+        self.aramour.Light[0, 11, 11] = 150
+        self.aramour.LDPressure[0, 11, 11] = 250
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_streamed_map(self):
+        with self.aramour.stream_map(self.filename) as writer:
+            self.aramour.write_time_step(writer, 0)
+            self.aramour.run(1, 4, 15, writer=writer)
+
+        for lazy in [False, True]:
+            loaded = MS.Map()
+            self.assertEqual(loaded.load_map(self.filename, lazy), (15, 4))
+            self.assertEqual(loaded.Light.shape, (4, 21, 21))
+            for name in ['Light', 'Dark', 'LDPressure']:
+                self.assertTrue(np.array_equal(
+                    getattr(loaded, name)[3, 5:9, 2:12],
+                    getattr(self.aramour, name)[3, 5:9, 2:12]))
+            self.assertTrue(np.array_equal(loaded.DifDark,
+                                           self.aramour.DifDark))
+            loaded.close_map()
+
+    def test_save_map(self):
+        self.aramour.run(1, 3, 15)
+        self.aramour.save_map(self.filename, compression='gzip')
+        loaded = MS.Map()
+        self.assertEqual(loaded.load_map(self.filename), (15, 4))
+        self.assertEqual(loaded.dtype, np.float64)
+        self.assertTrue(np.array_equal(np.asarray(loaded.LDPressure),
+                                       np.asarray(self.aramour.LDPressure)))
+
+    def test_save_loaded_map(self):
+        self.aramour.run(1, 3, 15)
+        self.aramour.save_map(self.filename)
+        history = np.asarray(self.aramour.Light)
+
+        # Save again from a map loaded each way, and from plain arrays.
+        for lazy in [False, True, 'arrays']:
+            loaded = MS.Map()
+            loaded.load_map(self.filename, lazy is True)
+            if lazy == 'arrays':
+                for name in ['Light', 'Dark', 'LDPressure']:
+                    setattr(loaded, name, np.asarray(getattr(loaded, name)))
+            copy = os.path.join(self.folder.name, 'copy_{}'.format(lazy))
+            loaded.save_map(copy)
+            loaded.close_map()
+
+            again = MS.Map()
+            self.assertEqual(again.load_map(copy), (15, 4))
+            self.assertTrue(np.array_equal(np.asarray(again.Light), history))
+
+
+class TestProfiling(test.TestCase):
+
+    def test_phases(self):
+        records = []
+        profiler = MP.Profiler(sink=records.append, capture='cprofile')
+        region = MF.RegionMap(seed=1)
+        region.initialise_map(6, 8)
+        region.find_magic(0, 3, 6, 8, np.array([3, 2]), profiler=profiler,
+                          progress=False)
+
+        self.assertEqual([record['time'] for record in records], [0, 1, 2])
+        for name in ['boundaries', 'heat', 'remainder', 'clamp',
+                     'create_next_time']:
+            self.assertIn(name, records[0]['phases'])
+        self.assertEqual(profiler.steps, 3)
+        self.assertEqual(len(profiler.summary()), len(records[0]['phases']))
+        self.assertIsNotNone(profiler.stats)
+        self.assertIsInstance(region.profiler, MP.NullProfiler)
+
+        lines = []
+        profiler.report(lines.append, functions=3)
+        self.assertTrue(lines[0].startswith('3 time steps'))
+
+    def test_memory_capture(self):
+        profiler = MP.Profiler(capture='tracemalloc')
+        region = MF.RegionMap(seed=1)
+        region.initialise_map(6, 8)
+        region.find_magic(0, 2, 6, 8, np.array([3, 2]), profiler=profiler,
+                          progress=False)
+        self.assertIsNotNone(profiler.snapshot)
+        self.assertRaises(ValueError, MP.Profiler, capture='perf')
+
+    def test_progress_reporter(self):
+        lines = []
+        reporter = MP.ProgressReporter(interval=3600, write=lines.append)
+        for time in range(5):
+            reporter(time, 5)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0], 'Time = 0')
+        self.assertTrue(lines[1].startswith('Time = 4 ('))
+
+
+class TestBenchmarks(test.TestCase):
+
+    def test_suite(self):
+        suite = BM.BenchmarkSuite(sizes=[12], steps=[2], repeats=1,
+                                  backends=['numpy'])
+        results = suite.run(progress=None)
+        names = [result['name'] for result in results]
+        self.assertIn('step[numpy]', names)
+        self.assertIn('load_map', names)
+        self.assertTrue(all(result['wall_time'] > 0 and
+                            result['peak_memory'] > 0 for result in results))
+
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'baseline.json')
+            suite.save(results, filename)
+            self.assertEqual(suite.compare(results, filename), [])
+            slower = [dict(result, wall_time=2 * result['wall_time'])
+                      for result in results]
+            self.assertEqual(len(suite.compare(slower, filename)),
+                             len(results))
+
+        self.assertRaises(ValueError, BM.BenchmarkSuite, sizes=[15, 8])
+        self.assertIn('cell updates per second', BM.__doc__)
+
+
 if __name__ == '__main__':
     test.main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+# Author: Jack Adams
+# Date Started: 26/10/16
+# Last Updated: 26/10/16
+
+# This script reports how far a single precision run of the Map drifts from
+# a double precision run of the same scenario as weatherScript.py. Both runs
+# use the same seed, so any difference comes from the precision alone,
+# including its effect on the boundary conditions which are drawn around the
+# values already in the map.
+
+import numpy as np
+import MapStructures
+
+
+def run_scenario(dtype, steps, width, seed):
+    """
+    Runs the weatherScript.py scenario at one precision.
+
+    :param dtype: Either np.float64 or np.float32.
+    :param steps: The number of time steps to run for.
+    :param width: The number of points across the region of interest.
+    :param seed: The seed for the random numbers.
+    :return: The map once it has been run.
+    """
+
+    aramour = MapStructures.Map(seed)
+    aramour.prepare_map_arrays(width, dtype=dtype)
+    aramour.initialise_values(100, 0.04)
+    aramour.create_next_time_step()
+    aramour.Light[0, 11, 11] = 150
+    aramour.LDPressure[0, 11, 11] = 250
+    aramour.run(1, steps, width)
+
+    return aramour
+
+
+width = 15
+steps = 100
+double = run_scenario(np.float64, steps, width, seed=1)
+single = run_scenario(np.float32, steps, width, seed=1)
+
+print('Bytes per field per time step: float64 {}, float32 {}'.format(
+    double.Light[0].nbytes, single.Light[0].nbytes))
+print('{:>6} {:>11} {:>14} {:>14}'.format('Step', 'Field', 'Max abs diff',
+                                          'Max rel diff'))
+for tstep in [1, 10, 25, 50, steps - 1]:
+    for name in ['Light', 'Dark', 'LDPressure']:
+        reference = getattr(double, name)[tstep]
+        difference = np.abs(getattr(single, name)[tstep] - reference)
+        relative = difference.max() / max(np.abs(reference).max(), 1e-300)
+        print('{:>6} {:>11} {:>14.3e} {:>14.3e}'.format(
+            tstep, name, difference.max(), relative))
@@ -1,6 +1,6 @@
 # Author: Jack Adams
 # Date Started: 18/05/27
-# Last Updated: 18/06/1
+# Last Updated: 26/10/16
 
 # This script is used to run the finite element schemes over time.
 
@@ -9,21 +9,19 @@ import numpy as np
 
 aramour = MapStructures.Map()
 width = 15
-aramour.prepare_map_arrays(width)
+# Only the last two time steps are needed by the stencils, so keep a rolling
+# history to run in constant memory.
+aramour.prepare_map_arrays(width, history='rolling')
 aramour.initialise_values(100, 0.04)
 aramour.create_next_time_step()
 aramour.Light[0, 11, 11] = 150
 aramour.LDPressure[0, 11, 11] = 250
 
-for tstep in range(1,100):
-    aramour.calculate_next_time_step(aramour.Light, aramour.DifLight,
-                                     aramour.LDPressure, tstep, width)
-    aramour.calculate_next_time_step(aramour.Dark, aramour.DifDark,
-                                     aramour.LDPressure, tstep, width)
-    aramour.generate_BCs(aramour.Light, tstep, width)
-    aramour.generate_BCs(aramour.Dark, tstep, width)
-    aramour.LD_forcing_functions(aramour.Light, aramour.Dark, tstep, width)
-    aramour.update_pressure(aramour.Light, aramour.Dark, aramour.LDPressure,
-                            tstep, width)
-    aramour.create_next_time_step()
+# Save a checkpoint every 100 time steps, so a long run which is stopped can
+# be carried on with aramour.load_checkpoint('weather_checkpoint'). Each time
+# step is also written to an archive which can be read back with load_map.
+with aramour.stream_map('weather_run', compression='gzip') as writer:
+    aramour.write_time_step(writer, 0)
+    aramour.run(1, 100, width, checkpoint='weather_checkpoint',
+                writer=writer)
 print("Done!")